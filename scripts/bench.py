@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Benchmarks token usage aggregation and reporting on a synthetic corpus.
+
+Times cold and warm aggregate_usage runs, an incremental run after a
+fraction of the session files changed, a full cache-file rewrite, both
+whole-file parsers, the CLI reports and the TUI view model. Results are written as JSON so that runs
+of different versions can be compared with --baseline.
+"""
+
+import argparse
+import importlib.util
+import inspect
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import gen_corpus
+import token_usage
+import tui
+
+RESULTS_VERSION = 1
+
+
+def _time(fn: Callable[[], Any], repeat: int,
+          setup: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """Runs fn repeat times, after setup each time, and summarizes seconds."""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def _append_fraction(corpus: Path, fraction: float) -> None:
+    """Appends a gemini message to a fraction of the session files.
+
+    This is what the Gemini CLI does to a live session, so the following
+    aggregation has new messages to parse, not just a changed mtime.
+    """
+    files = sorted(corpus.glob("*/chats/session-*.json"))
+    step = max(1, int(1 / fraction)) if fraction > 0 else len(files) + 1
+    for path in files[::step]:
+        st = path.stat()
+        session = json.loads(path.read_bytes())
+        replies = [m for m in session["messages"] if m.get("type") == "gemini"]
+        session["messages"].append(dict(replies[-1] if replies else {
+            "type": "gemini", "model": "gemini-2.5-flash",
+            "tokens": {"input": 1000, "output": 100, "cached": 0}},
+            id=f"bench-{len(session['messages'])}"))
+        path.write_text(json.dumps(session, indent=2), encoding="utf-8")
+        os.utime(path, (st.st_atime, st.st_mtime + 1))
+
+
+def load_tree(scripts_dir: Path) -> Tuple[Any, Any]:
+    """Imports token_usage and tui from another checkout's scripts dir.
+
+    Used to benchmark an older version, e.g. a git worktree of the
+    baseline, with the same harness and corpus.
+    """
+    modules = []
+    for name in ("token_usage", "tui"):
+        spec = importlib.util.spec_from_file_location(
+            name, scripts_dir / f"{name}.py")
+        module = importlib.util.module_from_spec(spec)
+        # tui imports token_usage by name
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        modules.append(module)
+    return modules[0], modules[1]
+
+
+def run_benchmarks(corpus: Path, store: str = "json", jobs: Optional[int] = 1,
+                   repeat: int = 3, changed_fraction: float = 0.01,
+                   modules: Optional[Tuple[Any, Any]] = None
+                   ) -> Dict[str, Dict[str, Any]]:
+    """Times each phase on an existing corpus.
+
+    Phases that the benchmarked version does not support (older versions
+    lack stores, jobs or the parsers) are left out.
+
+    Args:
+        corpus: Session tree, used as the base_dir of aggregate_usage. Its
+                cache files are deleted and recreated.
+        store: Usage store backend to benchmark.
+        jobs: Worker processes for aggregate_usage.
+        repeat: Runs per phase.
+        changed_fraction: Share of files appended to before each
+                          incremental run.
+        modules: The (token_usage, tui) modules to benchmark, see
+                 load_tree. Defaults to this checkout's.
+
+    Returns:
+        Timing summaries (seconds) keyed by phase name.
+    """
+    usage, view_module = modules or (token_usage, tui)
+    cache_file = corpus / getattr(usage, "STORE_FILES",
+                                  {"json": "usage_cache.json"})[store]
+    params = inspect.signature(usage.aggregate_usage).parameters
+    options = {name: value for name, value in (("jobs", jobs), ("store", store))
+               if name in params}
+
+    def aggregate() -> Any:
+        return usage.aggregate_usage(base_dir=corpus, **options)
+
+    def drop_cache() -> None:
+        for path in corpus.glob(cache_file.name + "*"):
+            path.unlink()
+
+    timings = {}
+    timings["aggregate_cold"] = _time(aggregate, repeat, drop_cache)
+    timings["aggregate_warm"] = _time(aggregate, repeat)
+    timings["aggregate_incremental"] = _time(
+        aggregate, repeat, lambda: _append_fraction(corpus, changed_fraction))
+
+    if store == "json" and hasattr(usage, "JsonUsageStore"):
+        json_store = usage.JsonUsageStore(cache_file)
+        records = json_store.load()
+        dirs = dict(json_store.dirs)
+
+        def rewrite() -> None:
+            json_store.dirty = True
+            json_store.save(records, {}, [], dirs)
+        timings["cache_rewrite"] = _time(rewrite, repeat)
+        json_store.close()
+
+    # Both whole-file parsers on the same bytes: where they break even
+    # decides token_usage.EXTRACT_MIN_BYTES
+    sessions = [(path, path.read_bytes())
+                for path in sorted(corpus.glob("*/chats/session-*.json"))]
+
+    def parse_extracted() -> None:
+        for path, raw in sessions:
+            try:
+                usage._parse_extracted(path, raw)
+            except usage._ExtractError:
+                usage._parse_decoded(path, raw)
+
+    def parse_decoded() -> None:
+        for path, raw in sessions:
+            usage._parse_decoded(path, raw)
+    if hasattr(usage, "_parse_extracted"):
+        timings["parse_extracted"] = _time(parse_extracted, repeat)
+        timings["parse_decoded"] = _time(parse_decoded, repeat)
+
+    stats = aggregate()
+    sink = io.StringIO()
+
+    def report(**kwargs: Any) -> Callable[[], None]:
+        def run() -> None:
+            with redirect_stdout(sink):
+                usage.print_report(stats, **kwargs)
+            sink.seek(0)
+            sink.truncate()
+        return run
+
+    def summary() -> None:
+        with redirect_stdout(sink):
+            usage.print_summary_statistics(stats, show_models=True)
+        sink.seek(0)
+        sink.truncate()
+
+    timings["print_report"] = _time(report(), repeat)
+    timings["print_report_models"] = _time(report(show_models=True), repeat)
+    timings["print_summary_statistics"] = _time(summary, repeat)
+
+    view = view_module.UsageTUI()
+    view.stats = stats
+    for name, show_models, current_filter in [
+            ("tui_refresh", False, "all"),
+            ("tui_refresh_models", True, "all"),
+            ("tui_refresh_this_month", False, "this-month")]:
+        view.show_models = show_models
+        view.current_filter = current_filter
+        timings[name] = _time(view.refresh_view_data, repeat)
+    return timings
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float) -> List[str]:
+    """Lists phases whose median got slower than baseline by > tolerance."""
+    regressions = []
+    for name, timing in results["timings"].items():
+        before = baseline.get("timings", {}).get(name)
+        if not before or before["median"] <= 0:
+            continue
+        ratio = timing["median"] / before["median"]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: {before['median']:.4f}s -> "
+                               f"{timing['median']:.4f}s ({ratio:.2f}x)")
+    return regressions
+
+
+def main() -> None:
+    """CLI Entry point."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark token usage aggregation on a synthetic corpus.")
+    parser.add_argument("--corpus", type=Path,
+                        help="Session tree to use. Generated here if empty; "
+                        "a temporary one is used if omitted.")
+    parser.add_argument("--sessions", type=int, default=1000,
+                        help="Sessions to generate (e.g. 1000 to 100000).")
+    parser.add_argument("--projects", type=int, default=20,
+                        help="Project directories to generate.")
+    parser.add_argument("--days", type=int, default=90,
+                        help="Days of history to generate.")
+    parser.add_argument("--messages", type=int, default=20,
+                        help="Mean messages per generated session.")
+    parser.add_argument("--message-chars", type=int, default=400,
+                        help="Mean characters per generated message.")
+    parser.add_argument("--models", type=gen_corpus.parse_model_mix,
+                        default=dict(gen_corpus.DEFAULT_MODEL_MIX),
+                        help="Model mix as model:weight,model:weight.")
+    parser.add_argument("--store", choices=sorted(token_usage.USAGE_STORES),
+                        default="json", help="Usage store to benchmark.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Worker processes for aggregate_usage.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per phase.")
+    parser.add_argument("--scripts", type=Path,
+                        help="Benchmark token_usage.py and tui.py from this "
+                        "directory instead, e.g. a worktree of an older "
+                        "version to produce a --baseline.")
+    parser.add_argument("--output", type=Path,
+                        help="Write the JSON results here instead of stdout.")
+    parser.add_argument("--baseline", type=Path,
+                        help="Earlier results to compare against; exits "
+                        "with status 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline.")
+    args = parser.parse_args()
+
+    spec = gen_corpus.CorpusSpec(sessions=args.sessions, projects=args.projects,
+                                 days=args.days, messages=args.messages,
+                                 message_chars=args.message_chars,
+                                 model_mix=args.models)
+    with TemporaryDirectory() as tmpdirname:
+        corpus = args.corpus or Path(tmpdirname)
+        corpus.mkdir(parents=True, exist_ok=True)
+        counts = None
+        if not any(corpus.glob("*/chats/session-*.json")):
+            counts = gen_corpus.generate_corpus(corpus, spec)
+        modules = load_tree(args.scripts) if args.scripts else None
+        timings = run_benchmarks(corpus, args.store, args.jobs, args.repeat,
+                                 modules=modules)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scripts": str(args.scripts) if args.scripts else None,
+        "store": args.store,
+        "jobs": args.jobs,
+        "corpus": {"path": str(args.corpus) if args.corpus else None,
+                   "generated": counts,
+                   "spec": vars(spec) if counts else None},
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "timings": timings,
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Tests for the corpus generator and the benchmark harness."""
+
+import json
+import os
+import sys
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+# Add the scripts directory to path to import the modules
+sys.path.append(os.path.dirname(__file__))
+import bench
+import gen_corpus
+import token_usage
+
+
+class TestBench(unittest.TestCase):
+    """Smoke tests that keep the benchmark tooling runnable."""
+
+    def test_generated_corpus_parses(self) -> None:
+        """Verifies that generated sessions are deterministic and parse."""
+        spec = gen_corpus.CorpusSpec(sessions=30, projects=3, days=10,
+                                     end_date="2026-01-31", seed=7)
+        with TemporaryDirectory() as first, TemporaryDirectory() as second:
+            counts = gen_corpus.generate_corpus(Path(first), spec)
+            self.assertEqual(counts, gen_corpus.generate_corpus(Path(second), spec))
+            self.assertEqual(counts["files"], 30)
+
+            self.assertEqual(len(list(Path(first).glob("*/chats/session-*.json"))), 30)
+            # The layout must be the one the fast extractor handles
+            for path in Path(first).glob("*/chats/session-*.json"):
+                token_usage._extract_session(path.read_bytes())
+
+            stats = token_usage.aggregate_usage(base_dir=Path(first))
+            self.assertEqual(stats.range_totals("2026-01-01", "2026-02-01")[0], 30)
+            self.assertTrue(all("2026-01-22" <= d <= "2026-01-31" for d in stats))
+
+    def test_run_benchmarks(self) -> None:
+        """Verifies the phases reported and the regression comparison."""
+        spec = gen_corpus.CorpusSpec(sessions=20, projects=2, days=5, seed=1)
+        with TemporaryDirectory() as tmpdirname:
+            corpus = Path(tmpdirname)
+            gen_corpus.generate_corpus(corpus, spec)
+            timings = bench.run_benchmarks(corpus, repeat=1)
+        self.assertEqual(set(timings), {
+            "aggregate_cold", "aggregate_warm", "aggregate_incremental",
+            "cache_rewrite", "parse_extracted", "parse_decoded", "print_report", "print_report_models",
+            "print_summary_statistics", "tui_refresh", "tui_refresh_models",
+            "tui_refresh_this_month"})
+        json.dumps(timings)
+
+        results = {"timings": {"a": {"median": 2.0}, "b": {"median": 1.0}}}
+        baseline = {"timings": {"a": {"median": 1.0}, "b": {"median": 1.0}}}
+        regressions = bench.compare(results, baseline, tolerance=0.5)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("a:"))
+
+
+if __name__ == "__main__":
+    unittest.main()
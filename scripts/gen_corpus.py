@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Generates synthetic Gemini CLI session trees for benchmarking.
+
+The layout and file format follow what the Gemini CLI writes under
+~/.gemini/tmp: <project hash>/chats/session-<start>-<id>.json documents,
+pretty-printed with two-space indentation, with one mtime per file at the
+session's last update.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+DEFAULT_MODEL_MIX = {
+    "gemini-2.5-pro": 0.3,
+    "gemini-2.5-flash": 0.4,
+    "gemini-3-flash": 0.2,
+    "gemini-2.5-flash-lite": 0.1,
+}
+
+# Includes characters that JSON escapes, as real content does
+_CONTENT_CHARS = "abcdefghijklmnopqrstuvwxyz     .,\n\"\\{}[]"
+
+
+@dataclass
+class CorpusSpec:
+    """Shape of a synthetic corpus."""
+    sessions: int = 1000
+    projects: int = 20
+    days: int = 90
+    # Mean messages per session, user and gemini turns included
+    messages: int = 20
+    # Mean characters of message content
+    message_chars: int = 400
+    model_mix: Dict[str, float] = field(
+        default_factory=lambda: dict(DEFAULT_MODEL_MIX))
+    end_date: Optional[str] = None
+    seed: int = 0
+
+
+def parse_model_mix(text: str) -> Dict[str, float]:
+    """Parses "model:weight,model:weight" into a weight mapping."""
+    mix = {}
+    for item in text.split(","):
+        model, _, weight = item.partition(":")
+        mix[model.strip()] = float(weight) if weight else 1.0
+    return mix
+
+
+def _session(rng: random.Random, spec: CorpusSpec, project_hash: str,
+             start: datetime) -> Dict:
+    """Builds one session document with a growing context window."""
+    models = list(spec.model_mix)
+    weights = list(spec.model_mix.values())
+    model = rng.choices(models, weights)[0]
+    n_messages = max(2, int(rng.expovariate(1 / spec.messages)))
+    session_id = f"{rng.getrandbits(128):032x}"
+    session_id = "-".join([session_id[:8], session_id[8:12], session_id[12:16],
+                           session_id[16:20], session_id[20:]])
+
+    messages = []
+    context = rng.randint(8_000, 15_000)
+    now = start
+    for i in range(n_messages):
+        now += timedelta(seconds=rng.randint(5, 300))
+        chars = max(1, int(rng.expovariate(1 / spec.message_chars)))
+        chunk = "".join(rng.choice(_CONTENT_CHARS) for _ in range(64))
+        message = {
+            "id": f"{session_id[:8]}-{i}",
+            "timestamp": now.isoformat().replace("+00:00", "Z"),
+            "type": "user" if i % 2 == 0 else "gemini",
+            "content": (chunk * (chars // 64 + 1))[:chars],
+        }
+        if message["type"] == "gemini":
+            # Occasionally switch models mid-session, like /model does
+            if rng.random() < 0.05:
+                model = rng.choices(models, weights)[0]
+            output = rng.randint(50, 4_000)
+            cached = int(context * rng.uniform(0.0, 0.9))
+            thoughts = rng.randint(0, 2_000)
+            message["thoughts"] = [{"subject": "Planning", "description": "x" * 80,
+                                    "timestamp": message["timestamp"]}]
+            message["tokens"] = {
+                "input": context - cached, "output": output, "cached": cached,
+                "thoughts": thoughts, "tool": 0,
+                "total": context + output + thoughts,
+            }
+            message["model"] = model
+            context += output + rng.randint(100, 30_000)
+        messages.append(message)
+
+    return {
+        "sessionId": session_id,
+        "projectHash": project_hash,
+        "startTime": start.isoformat().replace("+00:00", "Z"),
+        "lastUpdated": now.isoformat().replace("+00:00", "Z"),
+        "messages": messages,
+    }
+
+
+def generate_corpus(root: Path, spec: CorpusSpec) -> Dict[str, int]:
+    """Writes spec.sessions session files under root.
+
+    Args:
+        root: Directory playing the role of ~/.gemini/tmp.
+        spec: Shape of the corpus. The same spec always produces the same
+              files.
+
+    Returns:
+        Counts of the generated files, messages, gemini messages and bytes.
+    """
+    rng = random.Random(spec.seed)
+    if spec.end_date:
+        end = datetime.strptime(spec.end_date, "%Y-%m-%d")
+    else:
+        end = datetime.now()
+    end = end.replace(hour=0, minute=0, second=0, microsecond=0,
+                      tzinfo=timezone.utc)
+    projects = [hashlib.sha256(f"/home/user/project-{p}".encode()).hexdigest()
+                for p in range(spec.projects)]
+
+    counts = {"files": 0, "messages": 0, "gemini_messages": 0, "bytes": 0}
+    for _ in range(spec.sessions):
+        project_hash = rng.choice(projects)
+        start = end - timedelta(days=rng.randrange(spec.days),
+                                seconds=-rng.randrange(20 * 3600))
+        session = _session(rng, spec, project_hash, start)
+        chat_dir = root / project_hash / "chats"
+        chat_dir.mkdir(parents=True, exist_ok=True)
+        name = (f"session-{start.strftime('%Y-%m-%dT%H-%M')}-"
+                f"{session['sessionId'][:8]}.json")
+        path = chat_dir / name
+        data = json.dumps(session, indent=2)
+        path.write_text(data, encoding="utf-8")
+        last_updated = datetime.fromisoformat(
+            session["lastUpdated"].replace("Z", "+00:00")).timestamp()
+        os.utime(path, (last_updated, last_updated))
+
+        counts["files"] += 1
+        counts["messages"] += len(session["messages"])
+        counts["gemini_messages"] += sum(
+            1 for m in session["messages"] if m["type"] == "gemini")
+        counts["bytes"] += len(data)
+    return counts
+
+
+def main() -> None:
+    """CLI Entry point."""
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic Gemini CLI session tree.")
+    parser.add_argument("output", type=Path,
+                        help="Directory to fill, used like ~/.gemini/tmp.")
+    parser.add_argument("--sessions", type=int, default=1000,
+                        help="Number of session files.")
+    parser.add_argument("--projects", type=int, default=20,
+                        help="Number of project hash directories.")
+    parser.add_argument("--days", type=int, default=90,
+                        help="Days of history the sessions are spread over.")
+    parser.add_argument("--messages", type=int, default=20,
+                        help="Mean messages per session.")
+    parser.add_argument("--message-chars", type=int, default=400,
+                        help="Mean characters of message content.")
+    parser.add_argument("--models", type=parse_model_mix,
+                        default=dict(DEFAULT_MODEL_MIX),
+                        help="Model mix as model:weight,model:weight.")
+    parser.add_argument("--end-date",
+                        help="Last day of history (YYYY-MM-DD, default today).")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed.")
+    args = parser.parse_args()
+
+    spec = CorpusSpec(sessions=args.sessions, projects=args.projects,
+                      days=args.days, messages=args.messages,
+                      message_chars=args.message_chars, model_mix=args.models,
+                      end_date=args.end_date, seed=args.seed)
+    counts = generate_corpus(args.output, spec)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
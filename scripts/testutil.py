@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Helpers shared by the tests: session files and comparable stats."""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def gemini_message(model: str = "gemini-3-flash", **tokens: int) -> Dict[str, Any]:
+    """Returns a gemini message of a session file using the given tokens."""
+    return {"type": "gemini", "model": model, "tokens": tokens}
+
+
+def write_session(path: Path, session_id: str, messages: List[Any],
+                  day: str = "2026-01-20", indent: Optional[int] = None,
+                  mtime: Optional[float] = None) -> Path:
+    """Writes a session file as the Gemini CLI does, creating its directory.
+
+    Args:
+        path: The session file, e.g. <root>/project1/chats/session-1.json.
+        session_id: The sessionId of the file.
+        messages: Messages of the session, e.g. from gemini_message().
+        day: Date (YYYY-MM-DD) of the session start.
+        indent: JSON indentation; the Gemini CLI writes 2.
+        mtime: Optional modification time to set.
+
+    Returns:
+        The path written.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        "sessionId": session_id,
+        "startTime": f"{day}T12:00:00Z",
+        "messages": messages,
+    }, indent=indent))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def summarize(stats: Any, session_names: bool = True
+              ) -> Dict[Tuple[str, str], Tuple[Any, ...]]:
+    """Flattens stats into comparable (date, model) -> totals.
+
+    Args:
+        stats: A UsageTable or nested date -> model -> ModelStats dict.
+        session_names: Compare the sorted session names; False compares
+                       only their number, e.g. for hashed rollup sessions.
+    """
+    return {(d, m): (sorted(s.sessions) if session_names else s.session_count,
+                     s.input_tokens, s.cached_tokens, s.output_tokens,
+                     round(s.cost, 9))
+            for d, models in stats.items() for m, s in models.items()}
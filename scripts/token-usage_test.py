@@ -4,9 +4,11 @@
 import io
 import json
 import os
+import random
 import sys
+import time
 import unittest
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from unittest.mock import MagicMock, patch
@@ -14,6 +16,7 @@ from unittest.mock import MagicMock, patch
 # Add the scripts directory to path to import token_usage
 sys.path.append(os.path.dirname(__file__))
 import token_usage
+from testutil import gemini_message, summarize, write_session
 
 
 class TestTokenUsage(unittest.TestCase):
@@ -95,6 +98,441 @@ class TestTokenUsage(unittest.TestCase):
             model_stats = stats["2026-01-21"]["gemini-3-flash"]
             self.assertEqual(model_stats.input_tokens, 0)
 
+    def test_parallel_matches_serial(self) -> None:
+        """Verifies that the process pool path produces identical output."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            models = ["gemini-3-flash", "gemini-2.5-pro", "gemini-2.5-flash"]
+            for p in range(3):
+                chat_dir = tmp_path / f"project{p}" / "chats"
+                chat_dir.mkdir(parents=True)
+                for i in range(5):
+                    session_data = {
+                        "sessionId": f"s-{p}-{i}",
+                        "startTime": f"2026-01-{10 + i:02d}T12:00:00Z",
+                        "messages": [
+                            {
+                                "type": "gemini",
+                                "model": models[(p + j) % len(models)],
+                                "tokens": {
+                                    "input": 1000 * j + 7,
+                                    "cached": 333 * i,
+                                    "output": 17 * j,
+                                    "thoughts": 3,
+                                },
+                            } for j in range(4)
+                        ],
+                    }
+                    with (chat_dir / f"session-{i}.json").open("w") as f:
+                        json.dump(session_data, f)
+
+            cache_file = tmp_path / "usage_cache.json"
+            reports = []
+            caches = []
+            for jobs in (1, 2):
+                if cache_file.exists():
+                    cache_file.unlink()
+                stats = token_usage.aggregate_usage(base_dir=tmp_path, jobs=jobs)
+                output = io.StringIO()
+                with patch("sys.stdout", output):
+                    token_usage.print_report(stats, show_models=True)
+                reports.append(output.getvalue())
+                cache = json.loads(cache_file.read_bytes())
+                # Only the generation is random per document
+                del cache["generation"]
+                caches.append(cache)
+
+            self.assertEqual(reports[0], reports[1])
+            self.assertEqual(caches[0], caches[1])
+
+    def test_incremental_tail_parsing(self) -> None:
+        """Verifies that appended messages are parsed without a full reload."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            chat_dir = tmp_path / "project1" / "chats"
+            chat_dir.mkdir(parents=True)
+            session_file = chat_dir / "session-1.json"
+
+            def message(i: int) -> dict:
+                return {"id": f"m{i}", "content": "x" * 100,
+                        **gemini_message(input=100 * i, cached=i, output=10)}
+
+            messages = [{"type": "user", "content": "hi"}, message(1)]
+            write_session(session_file, "tail-session", messages, indent=2,
+                          mtime=1_000)
+            token_usage.aggregate_usage(base_dir=tmp_path)
+
+            # Append two messages: only the tail may be decoded
+            messages += [message(2), message(3)]
+            write_session(session_file, "tail-session", messages, indent=2,
+                          mtime=2_000)
+            with patch.object(token_usage, "_parse_full",
+                              side_effect=AssertionError("full reparse")):
+                stats = token_usage.aggregate_usage(base_dir=tmp_path)
+            self.assertEqual(stats["2026-01-20"]["gemini-3-flash"].input_tokens, 600)
+            self.assertEqual(stats["2026-01-20"]["gemini-3-flash"].output_tokens, 30)
+
+            json_store = token_usage.JsonUsageStore(tmp_path / "usage_cache.json")
+            cache = json_store.load()
+            json_store.close()
+            self.assertEqual(cache[str(session_file)]["tail"]["count"], 4)
+
+            # Rewriting earlier history falls back to a full reparse
+            messages[1] = message(12)
+            write_session(session_file, "tail-session", messages, indent=2,
+                          mtime=3_000)
+            stats = token_usage.aggregate_usage(base_dir=tmp_path)
+            self.assertEqual(stats["2026-01-20"]["gemini-3-flash"].input_tokens, 1700)
+
+    def test_extractor_matches_json_parser(self) -> None:
+        """Differential test of the fast extractor against a full json decode."""
+        rng = random.Random(7)
+        text_pool = ["", "plain", 'quo"ted', "multi\nline\n    }\n  ]", "\u00e9\u4e2d",
+                     '\n  "sessionId": "fake"', '\n      "tokens": {"input": 9}',
+                     "back\\slash", "x" * 5000]
+
+        def random_value(depth: int = 0) -> object:
+            kind = rng.randrange(6 if depth < 3 else 3)
+            if kind == 0:
+                return rng.choice(text_pool)
+            if kind == 1:
+                return rng.choice([None, True, 0, -1.5, 10**12])
+            if kind == 2:
+                return []
+            if kind == 3:
+                return [random_value(depth + 1) for _ in range(rng.randrange(4))]
+            if kind == 4:
+                return {}
+            return {rng.choice(["tokens", "type", "model", "args", "a"]):
+                    random_value(depth + 1) for _ in range(rng.randrange(4))}
+
+        def random_message() -> object:
+            roll = rng.random()
+            if roll < 0.05:
+                return rng.choice([None, "text", [], {}, [{"type": "gemini"}]])
+            msg: dict = {"id": str(rng.random())}
+            if roll < 0.5:
+                msg["type"] = "user"
+                msg["content"] = random_value()
+                return msg
+            msg["type"] = "gemini"
+            msg["content"] = rng.choice(text_pool)
+            if rng.random() < 0.7:
+                msg["thoughts"] = [{"subject": rng.choice(text_pool),
+                                    "tokens": {"input": 1}}]
+            if rng.random() < 0.9:
+                msg["model"] = rng.choice(["gemini-2.5-pro", "gemini-3-flash",
+                                           "gemini-2.5-flash-lite"])
+            if rng.random() < 0.9:
+                msg["tokens"] = rng.choice([None, {}, {
+                    "input": rng.randrange(300_000), "cached": rng.randrange(1000),
+                    "output": rng.randrange(5000), "thoughts": rng.randrange(500)}])
+            if rng.random() < 0.5:
+                msg["toolCalls"] = [{"args": random_value(1)}]
+            items = list(msg.items())
+            rng.shuffle(items)
+            return dict(items)
+
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            for i in range(200):
+                session: dict = {}
+                if rng.random() < 0.9:
+                    session["sessionId"] = f"s{i}"
+                session["projectHash"] = random_value(1)
+                session["startTime"] = rng.choice(
+                    ["2026-01-20T12:00:00Z", "2026-02-01T00:00:00Z", 20260120, None])
+                session["messages"] = rng.choice([
+                    None, [], [random_message() for _ in range(rng.randrange(30))]])
+                if rng.random() < 0.2:
+                    session["summary"] = random_value(1)
+                if rng.random() < 0.1:
+                    session = dict(reversed(list(session.items())))
+
+                session_file = tmp_path / f"session-{i}.json"
+                with session_file.open("w", encoding="utf-8") as f:
+                    json.dump(session, f, indent=rng.choice([2, 2, 2, None]),
+                              ensure_ascii=rng.random() < 0.5)
+                if i % 2:
+                    os.utime(session_file, (1_000, 1_000))
+
+                with self.subTest(session=i), patch.object(
+                        token_usage, "EXTRACT_MIN_BYTES", 0):
+                    expected = token_usage._parse_decoded(
+                        session_file, session_file.read_bytes())
+                    self.assertEqual(token_usage._parse_full(session_file), expected)
+
+    def test_sqlite_store_matches_json(self) -> None:
+        """Verifies the SQLite store reports the same usage as the JSON cache."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            chat_dir = tmp_path / "project1" / "chats"
+            chat_dir.mkdir(parents=True)
+
+            for i in range(4):
+                write_session(chat_dir / f"session-{i}.json", f"s{i}",
+                              [gemini_message("gemini-2.5-pro",
+                                              input=100 * (i + 1), output=5)],
+                              f"2026-01-{10 + i % 2}")
+
+            for _ in range(2):
+                self.assertEqual(
+                    summarize(token_usage.aggregate_usage(base_dir=tmp_path,
+                                                          store="sqlite")),
+                    summarize(token_usage.aggregate_usage(base_dir=tmp_path)))
+
+            # Changing and deleting files only touches their rows
+            write_session(chat_dir / "session-1.json", "s1",
+                          [gemini_message("gemini-2.5-pro", input=7, output=5)],
+                          "2026-01-12", mtime=5_000)
+            (chat_dir / "session-2.json").unlink()
+            stats = token_usage.aggregate_usage(base_dir=tmp_path, store="sqlite")
+            self.assertEqual(summarize(stats),
+                             summarize(token_usage.aggregate_usage(base_dir=tmp_path)))
+            self.assertEqual(sorted(stats), ["2026-01-10", "2026-01-11", "2026-01-12"])
+
+            filtered = token_usage.aggregate_usage(
+                base_dir=tmp_path, store="sqlite",
+                start_date="2026-01-11", end_date="2026-01-12")
+            self.assertEqual(sorted(filtered), ["2026-01-11", "2026-01-12"])
+            self.assertEqual(filtered["2026-01-11"]["gemini-2.5-pro"].input_tokens, 400)
+
+    def test_reprice_without_reparse(self) -> None:
+        """Verifies that a pricing change reprices cached tokens exactly."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            chat_dir = tmp_path / "project1" / "chats"
+            chat_dir.mkdir(parents=True)
+            for i in range(3):
+                write_session(chat_dir / f"session-{i}.json", f"s{i}", [
+                    gemini_message(model, input=150_000 * (j + 1),
+                                   cached=7_001 * i, output=333, thoughts=17)
+                    for j, model in enumerate(["gemini-2.5-pro", "gemini-3-flash",
+                                               "gemini-2.5-pro"])])
+
+            config = token_usage.load_config()
+            config.models["gemini-2.5-pro"] = token_usage.ModelPricing(
+                small_context=token_usage.PricingTier(1.1, 0.3, 7.7),
+                large_context=token_usage.PricingTier(3.3, 0.7, 11.1))
+            config.models["gemini-3-flash"] = token_usage.ModelPricing(
+                token_usage.PricingTier(0.37, 0.01, 2.9))
+
+            def costs(stats: dict) -> dict:
+                return {(d, m): s.cost for d, models in stats.items()
+                        for m, s in models.items()}
+
+            for store in ("json", "sqlite"):
+                with self.subTest(store=store):
+                    token_usage.aggregate_usage(base_dir=tmp_path, store=store)
+                    with patch.object(token_usage, "CONFIG", config):
+                        with patch.object(token_usage, "_parse_full",
+                                          side_effect=AssertionError("reparsed")):
+                            repriced = token_usage.aggregate_usage(
+                                base_dir=tmp_path, store=store)
+                        (tmp_path / token_usage.STORE_FILES[store]).unlink()
+                        reparsed = token_usage.aggregate_usage(
+                            base_dir=tmp_path, store=store)
+                    self.assertEqual(costs(repriced), costs(reparsed))
+
+            # Moving a context threshold needs per-message sizes: reparse
+            config.models["gemini-2.5-pro"].context_threshold = 100_000
+            config.invalidate()
+            with patch.object(token_usage, "CONFIG", config):
+                stats = token_usage.aggregate_usage(base_dir=tmp_path)
+                (tmp_path / "usage_cache.json").unlink()
+                self.assertEqual(costs(stats), costs(
+                    token_usage.aggregate_usage(base_dir=tmp_path)))
+
+    def test_json_store_journal(self) -> None:
+        """Verifies journal replay, compaction and interleaved saves."""
+        def record(n: int) -> dict:
+            return {"mtime": n, "size": n, "stats": {}, "tail": None,
+                    "pricing": "p"}
+
+        def load(path: Path) -> dict:
+            json_store = token_usage.JsonUsageStore(path)
+            try:
+                return json_store.load()
+            finally:
+                json_store.close()
+
+        with TemporaryDirectory() as tmpdirname:
+            path = Path(tmpdirname) / "usage_cache.json"
+            journal = path.with_name(path.name + ".journal")
+            json_store = token_usage.JsonUsageStore(path)
+            records = json_store.load()
+            # The first save writes the document
+            records.update(a=record(1), b=record(2))
+            json_store.save(records, dict(records), [], {})
+            self.assertEqual(json_store.written["cache_compactions"], 1)
+            doc = path.read_bytes()
+
+            # Later saves only append to the journal
+            records["c"] = record(3)
+            del records["a"]
+            json_store.save(records, {"c": record(3)}, ["a"], {"d": {"files": []}})
+            self.assertEqual(path.read_bytes(), doc)
+            self.assertEqual(load(path), {"b": record(2), "c": record(3)})
+
+            # A torn last line is dropped, and overwritten by the next save
+            with journal.open("ab") as f:
+                f.write(b'{"f": "e", "r": {"mti')
+            self.assertEqual(load(path), {"b": record(2), "c": record(3)})
+            records["e"] = record(5)
+            json_store.save(records, {"e": record(5)}, [], {"d": {"files": []}})
+            self.assertEqual(load(path), records)
+
+            # A journal of an older document generation is never replayed
+            stale = journal.read_bytes()
+            with patch.object(token_usage.JsonUsageStore, "COMPACT_MIN_BYTES", 0):
+                records["f"] = record(6)
+                json_store.save(records, {"f": record(6)}, [], {})
+            self.assertNotEqual(path.read_bytes(), doc)
+            journal.write_bytes(stale + b'{"f": "g", "r": null}\n')
+            self.assertEqual(load(path), records)
+
+            # Compaction waits for COMPACT_RATIO of the document size
+            journal.unlink()
+            with patch.object(token_usage.JsonUsageStore, "COMPACT_MIN_BYTES", 0):
+                first = token_usage.JsonUsageStore(path)
+                first.load()
+                doc = path.read_bytes()
+                first.save(records, {"f": record(6)}, [], {})
+                self.assertEqual(path.read_bytes(), doc)
+                big = dict(records, **{f"k{i}": record(i) for i in range(20)})
+                first.save(big, {k: v for k, v in big.items()
+                                 if k.startswith("k")}, [], {})
+                self.assertNotEqual(path.read_bytes(), doc)
+                self.assertEqual(journal.stat().st_size,
+                                 len(first._journal_header()))
+
+            # Interleaved runs: the second writer adds to the first one's
+            # records instead of replacing them, also when compacting
+            first = token_usage.JsonUsageStore(path)
+            mine = first.load()
+            first.lock.release()
+            second = token_usage.JsonUsageStore(path)
+            theirs = second.load()
+            theirs["x"] = record(7)
+            second.save(theirs, {"x": record(7)}, [], {})
+            mine["y"] = record(8)
+            first.save(mine, {"y": record(8)}, [], {})
+            self.assertEqual(load(path), dict(big, x=record(7), y=record(8)))
+            with patch.object(token_usage.JsonUsageStore, "COMPACT_MIN_BYTES", 0):
+                mine["z"] = record(9)
+                first.dirty = True
+                first.save(mine, {"z": record(9)}, [], {})
+            self.assertEqual(first.written["cache_compactions"], 1)
+            self.assertEqual(load(path),
+                             dict(big, x=record(7), y=record(8), z=record(9)))
+
+    def test_walk_session_files(self) -> None:
+        """Verifies the chats-only walk and opt-in directory mtime pruning."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            chat_dir = tmp_path / "project1" / "chats"
+            chat_dir.mkdir(parents=True)
+            (tmp_path / "project1" / "logs").mkdir()
+            (tmp_path / "project1" / "logs" / "session-x.json").write_text("{}")
+            (tmp_path / "chats").mkdir()
+            os.utime(tmp_path / "chats", (1_000, 1_000))
+
+            for i, inp in ((1, 10), (2, 20)):
+                write_session(chat_dir / f"session-{i}.json", f"s{i}",
+                              [gemini_message(input=inp)], mtime=1_000 + inp)
+            (chat_dir / "notes.json").write_text("{}")
+            os.utime(chat_dir, (1_000, 1_000))
+
+            dirs: dict = {}
+            found = list(token_usage.walk_session_files(tmp_path, {}, dirs))
+            self.assertEqual([Path(p).name for p, _, _ in found],
+                             ["session-1.json", "session-2.json"])
+            self.assertEqual(dirs[str(chat_dir)]["files"],
+                             ["session-1.json", "session-2.json"])
+            self.assertIn(str(tmp_path / "chats"), dirs)
+
+            def input_tokens(**kwargs: bool) -> int:
+                stats = token_usage.aggregate_usage(base_dir=tmp_path, **kwargs)
+                return stats["2026-01-20"]["gemini-3-flash"].input_tokens
+
+            self.assertEqual(input_tokens(trust_dir_mtime=True), 30)
+
+            # An in-place rewrite leaves the directory mtime alone: it is
+            # only seen when directory listings are not trusted
+            write_session(chat_dir / "session-2.json", "s2",
+                          [gemini_message(input=25)], mtime=1_025)
+            os.utime(chat_dir, (1_000, 1_000))
+            with patch.object(token_usage.os, "scandir",
+                              wraps=token_usage.os.scandir) as scandir:
+                self.assertEqual(input_tokens(trust_dir_mtime=True), 30)
+            self.assertEqual(scandir.call_count, 1)
+            self.assertEqual(input_tokens(), 35)
+
+            # A new file changes the directory mtime
+            write_session(chat_dir / "session-3.json", "s3",
+                          [gemini_message(input=30)], mtime=1_030)
+            self.assertEqual(input_tokens(trust_dir_mtime=True), 65)
+
+    def test_usage_watcher(self) -> None:
+        """Verifies that watched changes keep stats equal to a fresh aggregation."""
+        def messages(n: int) -> list:
+            return [gemini_message("gemini-2.5-pro", input=150_000 + i, cached=7,
+                                   output=3) for i in range(n)]
+
+        for use_inotify in (True, False):
+            with self.subTest(inotify=use_inotify), TemporaryDirectory() as tmpdirname:
+                tmp_path = Path(tmpdirname)
+                chat_dir = tmp_path / "project1" / "chats"
+                chat_dir.mkdir(parents=True)
+                write_session(chat_dir / "session-1.json", "s1", messages(2),
+                              indent=2)
+                write_session(chat_dir / "session-2.json", "s2", messages(1),
+                              indent=2)
+                # Another file of the same session: s1 must stay counted
+                write_session(chat_dir / "session-3.json", "s1", messages(1),
+                              indent=2)
+
+                watcher = token_usage.UsageWatcher(base_dir=tmp_path,
+                                                   poll_interval=0.0,
+                                                   use_inotify=use_inotify)
+                try:
+                    watcher.start()
+                    self.assertEqual(summarize(watcher.stats), summarize(
+                        token_usage.aggregate_usage(base_dir=tmp_path)))
+
+                    write_session(chat_dir / "session-1.json", "s1", messages(5),
+                                  indent=2)
+                    (chat_dir / "session-3.json").unlink()
+                    write_session(tmp_path / "project2" / "chats" / "session-4.json",
+                                  "s4", messages(1), "2026-01-21", indent=2)
+                    with patch.object(token_usage, "_parse_session_worker",
+                                      wraps=token_usage._parse_session_worker) as worker:
+                        generation = watcher.generation
+                        deadline = time.monotonic() + 5
+                        while (summarize(watcher.stats) != summarize(
+                                token_usage.aggregate_usage(base_dir=tmp_path))
+                               and time.monotonic() < deadline):
+                            watcher.wait(timeout=0.5)
+                    self.assertGreater(watcher.generation, generation)
+                    parsed = {Path(job[0]).name for (job,), _ in worker.call_args_list}
+                    self.assertEqual(parsed, {"session-1.json", "session-4.json"})
+
+                    stats = watcher.stats
+                    self.assertEqual(stats["2026-01-20"]["gemini-2.5-pro"].sessions,
+                                     {"s1", "s2"})
+                    self.assertEqual(stats["2026-01-21"]["gemini-2.5-pro"].input_tokens,
+                                     150_000)
+                    # The in-memory session index matches the cached one
+                    index = token_usage.load_session_index(tmp_path)
+                    for day in ("2026-01-20", "2026-01-21"):
+                        self.assertEqual(
+                            token_usage.session_breakdown(
+                                {day: watcher.session_rows(day)}, day),
+                            token_usage.session_breakdown(index, day))
+                    self.assertEqual(watcher.session_rows("2026-01-22"), [])
+                finally:
+                    watcher.close()
+
     def test_calculate_cost_tiers(self) -> None:
         """Tests tiered cost calculation for Pro models."""
         # Pro model (<= 200k context)
@@ -124,6 +562,263 @@ class TestTokenUsage(unittest.TestCase):
                 calculated_rate = cost_small * (1_000_000 / input_tokens)
                 self.assertAlmostEqual(calculated_rate, expected_rate, places=4)
 
+    def test_batch_entry_pricing(self) -> None:
+        """Verifies that batch repricing equals _entry_cost bit for bit."""
+        rng = random.Random(23)
+        models = [rng.choice(["gemini-3-pro", "gemini-2.5-pro", "gemini-3-flash",
+                              "gemini-2.0-flash", "not-a-gemini-model"])
+                  for _ in range(500)]
+        entries = []
+        for _ in models:
+            inp, c, out = (rng.randrange(0, 400_000), rng.randrange(0, 100_000),
+                           rng.randrange(0, 50_000))
+            large = [rng.randrange(0, inp + 1), rng.randrange(0, c + 1),
+                     rng.randrange(0, out + 1)]
+            entries.append({"input": inp, "cached": c, "output": out,
+                            "large": large})
+        expected = [token_usage._entry_cost(token_usage.CONFIG.get_pricing(m), s)
+                    for m, s in zip(models, entries)]
+
+        paths = [("array", None)]
+        if token_usage.numpy is not None:
+            paths.append(("numpy", token_usage.numpy))
+        for name, numpy in paths:
+            with self.subTest(path=name), \
+                    patch.object(token_usage, "numpy", numpy):
+                for s in entries:
+                    s["cost"] = None
+                token_usage._price_entries(list(zip(models, entries)))
+                self.assertEqual([s["cost"] for s in entries], expected)
+        token_usage._price_entries([])
+
+    def test_usage_table(self) -> None:
+        """Verifies the columnar table and its nested compatibility view."""
+        table = token_usage.UsageTable()
+        table.add("2026-01-20", "pro", "s1", 10, 1, 2, 0.5)
+        table.add("2026-01-20", "flash", "s1", 20, 0, 4, 0.25)
+        table.add("2026-01-20", "flash", "s2", 5, 0, 1, 0.125)
+        table.add("2026-01-21", "pro", "s3", 7, 0, 0, 1.0)
+
+        self.assertEqual(list(table), ["2026-01-20", "2026-01-21"])
+        self.assertNotIn("2026-01-22", table)
+        day = table["2026-01-20"]
+        self.assertEqual(sorted(day), ["flash", "pro"])
+        flash = day["flash"]
+        self.assertEqual((flash.input_tokens, flash.output_tokens, flash.cost),
+                         (25, 5, 0.375))
+        self.assertEqual(flash.sessions, {"s1", "s2"})
+        self.assertEqual(flash.session_count, 2)
+        # s1 used both models: counted once for the day
+        self.assertEqual(token_usage.day_totals(day), (2, 35, 1, 7, 0.875))
+        self.assertEqual(token_usage.day_totals(
+            {"pro": token_usage.ModelStats({"s1"}, 10, 1, 2, 0.5),
+             "flash": token_usage.ModelStats({"s1", "s2"}, 25, 0, 5, 0.375)}),
+            (2, 35, 1, 7, 0.875))
+
+        # Removing the last session drops the row, and its slot is reused
+        rows = len(table.date_col)
+        table.subtract("2026-01-21", "pro", "s3", 7, 0, 0, 1.0)
+        self.assertNotIn("2026-01-21", table)
+        table.subtract("2026-01-20", "flash", "s2", 5, 0, 1, 0.125)
+        self.assertEqual(token_usage.day_totals(table["2026-01-20"]),
+                         (1, 30, 1, 6, 0.75))
+        table.add("2026-01-22", "pro", "s4", 1, 0, 0, 0.0)
+        self.assertEqual(len(table.date_col), rows)
+        self.assertEqual(table["2026-01-22"]["pro"].sessions, {"s4"})
+
+    def test_get_pricing_longest_match(self) -> None:
+        """Verifies longest-match resolution independent of pattern order."""
+        tiers = {name: token_usage.ModelPricing(token_usage.PricingTier(i, 0, 0))
+                 for i, name in enumerate(["flash", "gemini-2.5-flash",
+                                           "gemini-2.5-flash-lite", "pro"])}
+        names = list(tiers)
+        for _ in range(5):
+            random.shuffle(names)
+            config = token_usage.Config(models={n: tiers[n] for n in names})
+            for model_name, expected in [
+                    ("gemini-2.5-flash-lite-preview", "gemini-2.5-flash-lite"),
+                    ("Gemini-2.5-Flash", "gemini-2.5-flash"),
+                    ("gemini-3-flash", "flash"),
+                    ("gemini-2.5-pro", "pro")]:
+                self.assertIs(config.get_pricing(model_name), tiers[expected])
+            self.assertIs(config.get_pricing("unknown"), config.default_pricing)
+
+        # Lookups are memoized until invalidated
+        config.models["gemini-3-flash"] = tiers["pro"]
+        self.assertIs(config.get_pricing("gemini-3-flash"), tiers["flash"])
+        config.invalidate()
+        self.assertIs(config.get_pricing("gemini-3-flash"), tiers["pro"])
+
+
+    def test_profile_counters(self) -> None:
+        """Verifies the per-phase profile of a cold, a warm and an append run."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            chat_dir = tmp_path / "project1" / "chats"
+            chat_dir.mkdir(parents=True)
+            session_file = chat_dir / "session-1.json"
+
+            message = {"content": "x" * 1000, **gemini_message(input=10)}
+            write_session(session_file, "s1", [message] * 3, indent=2,
+                          mtime=1_000)
+            (chat_dir / "session-2.json").write_text("{not json")
+            cold = token_usage.Profile()
+            token_usage.aggregate_usage(base_dir=tmp_path, profile=cold)
+            self.assertEqual(cold.counters["files_seen"], 2)
+            self.assertEqual(cold.counters["cache_misses"], 2)
+            self.assertEqual(cold.counters["parse_errors"], 1)
+            self.assertEqual(cold.counters["messages_seen"], 3)
+            self.assertEqual(cold.counters["bytes_parsed"],
+                             session_file.stat().st_size)
+            self.assertEqual(cold.counters["cache_bytes_written"],
+                             (tmp_path / "usage_cache.json").stat().st_size
+                             + (tmp_path / "usage_cache.json.journal").stat().st_size)
+            self.assertTrue({"load_cache", "walk", "parse", "save_cache",
+                             "query"} <= set(cold.phases))
+
+            # The invalid file stays a miss; an append parses the new tail only
+            write_session(session_file, "s1", [message] * 5, indent=2,
+                          mtime=2_000)
+            warm = token_usage.Profile()
+            token_usage.aggregate_usage(base_dir=tmp_path, profile=warm)
+            self.assertEqual(warm.counters["cache_hits"], 0)
+            self.assertEqual(warm.counters["messages_seen"], 2)
+            self.assertLess(warm.counters["bytes_parsed"],
+                            session_file.stat().st_size)
+            json.dumps(warm.as_dict())
+            self.assertIn("cache_misses", warm.format())
+
+            session_file.unlink()
+            (chat_dir / "session-2.json").unlink()
+            write_session(session_file, "s1", [message], indent=2, mtime=3_000)
+            token_usage.aggregate_usage(base_dir=tmp_path)
+            hit = token_usage.Profile()
+            token_usage.aggregate_usage(base_dir=tmp_path, profile=hit)
+            self.assertEqual(hit.counters["cache_hits"], 1)
+            self.assertNotIn("cache_bytes_written", hit.counters)
+
+    def test_scan_progress(self) -> None:
+        """Verifies scan progress counts and that a cancelled scan saves nothing."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            chat_dir = tmp_path / "project1" / "chats"
+            chat_dir.mkdir(parents=True)
+            for i in range(3):
+                write_session(chat_dir / f"session-{i}.json", f"s{i}",
+                              [gemini_message(input=10)])
+
+            cancelled = token_usage.ScanProgress()
+            cancelled.cancel()
+            with self.assertRaises(token_usage.ScanCancelled):
+                token_usage.aggregate_usage(base_dir=tmp_path, jobs=1,
+                                            progress=cancelled)
+            self.assertFalse((tmp_path / "usage_cache.json").exists())
+
+            progress = token_usage.ScanProgress()
+            token_usage.aggregate_usage(base_dir=tmp_path, jobs=1,
+                                        progress=progress)
+            self.assertEqual((progress.files_total, progress.files_scanned,
+                              progress.cache_hits), (3, 3, 0))
+            progress = token_usage.ScanProgress()
+            token_usage.aggregate_usage(base_dir=tmp_path, jobs=1,
+                                        progress=progress)
+            self.assertEqual((progress.files_total, progress.files_scanned,
+                              progress.cache_hits), (3, 3, 3))
+
+    def test_session_index(self) -> None:
+        """Verifies the session drill-down index against the stats it explains."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            chat_dir = tmp_path / "project1" / "chats"
+            chat_dir.mkdir(parents=True)
+
+            sessions = [[("gemini-3-flash", 100)],
+                        [("gemini-3-flash", 10), ("gemini-2.5-pro", 9000)],
+                        [("gemini-3-flash", 5000)],
+                        [("gemini-3-flash", 1)]]
+            for i, messages in enumerate(sessions[:3]):
+                write_session(chat_dir / f"session-{i}.json", f"s{i}",
+                              [gemini_message(model, input=inp, output=5)
+                               for model, inp in messages])
+
+            for store in ["json", "sqlite"]:
+                with self.subTest(store=store):
+                    stats = token_usage.aggregate_usage(base_dir=tmp_path,
+                                                        store=store)
+                    index = token_usage.load_session_index(tmp_path, store)
+                    day = token_usage.session_breakdown(index, "2026-01-20")
+                    self.assertEqual([row[0] for row in day], ["s1", "s2", "s0"])
+                    self.assertEqual(day[0][1], 9010)
+                    self.assertAlmostEqual(sum(row[4] for row in day), sum(
+                        s.cost for s in stats["2026-01-20"].values()))
+                    flash = token_usage.session_breakdown(
+                        index, "2026-01-20", "gemini-3-flash")
+                    self.assertEqual([row[0] for row in flash],
+                                     ["s2", "s0", "s1"])
+                    self.assertEqual(
+                        sum(row[1] for row in flash),
+                        stats["2026-01-20"]["gemini-3-flash"].input_tokens)
+
+                    # An unchanged cache is answered from the index alone
+                    with patch.object(token_usage.USAGE_STORES[store], "load",
+                                      side_effect=AssertionError):
+                        self.assertEqual(
+                            token_usage.load_session_index(tmp_path, store),
+                            index)
+
+            # A changed cache rebuilds the index
+            write_session(chat_dir / "session-3.json", "s3",
+                          [gemini_message(model, input=inp, output=5)
+                           for model, inp in sessions[3]])
+            token_usage.aggregate_usage(base_dir=tmp_path)
+            index = token_usage.load_session_index(tmp_path)
+            self.assertEqual(len(index["2026-01-20"]), 5)
+            self.assertEqual(token_usage.load_session_index(tmp_path / "none"),
+                             {})
+
+
+    def test_multiple_roots(self) -> None:
+        """Verifies that several roots merge into one report, each cached apart."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            roots = [tmp_path / "sync" / "host1", tmp_path / "sync" / "host2"]
+
+            for i, (root, inp) in enumerate([(roots[0], 100), (roots[0], 200),
+                                             (roots[1], 400)]):
+                write_session(root / "project1" / "chats" / f"session-{i}.json",
+                              f"s{i}", [gemini_message(input=inp, output=5)])
+            self.assertEqual(token_usage.root_labels(roots), ["host1", "host2"])
+
+            serial = token_usage.aggregate_usage(base_dir=roots, jobs=1)
+            day = serial["2026-01-20"]["gemini-3-flash"]
+            self.assertEqual((day.input_tokens, day.session_count), (700, 3))
+            parallel = token_usage.aggregate_usage(base_dir=roots, jobs=2)
+            self.assertEqual(parallel["2026-01-20"]["gemini-3-flash"].cost,
+                             day.cost)
+            for root in roots:
+                self.assertTrue((root / "usage_cache.json").exists())
+
+            by_root = token_usage.aggregate_usage(base_dir=roots, by_root=True)
+            self.assertEqual(
+                {m: s.input_tokens for m, s in by_root["2026-01-20"].items()},
+                {"host1/gemini-3-flash": 300, "host2/gemini-3-flash": 400})
+
+            # Only the changed root is parsed again
+            write_session(roots[1] / "project1" / "chats" / "session-3.json",
+                          "s3", [gemini_message(input=800, output=5)])
+            profile = token_usage.Profile()
+            stats = token_usage.aggregate_usage(base_dir=roots, jobs=2,
+                                                profile=profile)
+            self.assertEqual(profile.counters["files_seen"], 4)
+            self.assertEqual(profile.counters["cache_misses"], 1)
+            self.assertEqual(
+                stats["2026-01-20"]["gemini-3-flash"].input_tokens, 1500)
+
+            # Caches can live outside the synced trees
+            caches = tmp_path / "caches"
+            token_usage.aggregate_usage(base_dir=roots, cache_root=caches)
+            self.assertTrue((caches / "host2" / "usage_cache.json").exists())
+
 
 class TestDateFiltering(unittest.TestCase):
     """Tests for date range generation and filtering."""
@@ -156,6 +851,49 @@ class TestDateFiltering(unittest.TestCase):
         self.assertEqual(len(filtered), 1)
         self.assertIn("2026-01-10", filtered)
 
+    def test_filter_stats_table(self) -> None:
+        """Verifies the bisected date index of a UsageTable."""
+        table = token_usage.UsageTable()
+        for date_str in ["2026-01-10", "unknown", "2026-01-01", "2026-01-15",
+                         "2026-01-05"]:
+            table.add(date_str, "m", "s", 1, 0, 0, 0.0)
+        filtered = token_usage.filter_stats(table, "2026-01-05", "2026-01-10")
+        self.assertEqual(sorted(filtered), ["2026-01-05", "2026-01-10"])
+        self.assertEqual(filtered["2026-01-05"]["m"].input_tokens, 1)
+
+        table.add("2026-01-07", "m", "s", 1, 0, 0, 0.0)
+        table.subtract("2026-01-05", "m", "s", 1, 0, 0, 0.0)
+        self.assertEqual(table.date_slice("2026-01-02", "2026-01-14"),
+                         ["2026-01-07", "2026-01-10"])
+
+    def test_date_range_pushdown(self) -> None:
+        """Verifies that files too old for the range are neither parsed nor merged."""
+        with TemporaryDirectory() as tmpdirname:
+            tmp_path = Path(tmpdirname)
+            chat_dir = tmp_path / "project1" / "chats"
+            chat_dir.mkdir(parents=True)
+            for day in (1, 20):
+                write_session(chat_dir / f"session-{day}.json", f"s{day}",
+                              [gemini_message(input=day)], f"2026-01-{day:02d}",
+                              mtime=datetime(2026, 1, day, 13,
+                                             tzinfo=timezone.utc).timestamp())
+
+            with patch.object(token_usage, "_parse_session_worker",
+                              wraps=token_usage._parse_session_worker) as worker:
+                stats = token_usage.aggregate_usage(
+                    base_dir=tmp_path, start_date="2026-01-10",
+                    end_date="2026-01-31")
+            self.assertEqual(list(stats), ["2026-01-20"])
+            self.assertEqual([Path(job[0]).name for (job,), _ in worker.call_args_list],
+                             ["session-20.json"])
+
+            # A full run caches both; a ranged run keeps the old record
+            token_usage.aggregate_usage(base_dir=tmp_path)
+            token_usage.aggregate_usage(base_dir=tmp_path, start_date="2026-01-10",
+                                        end_date="2026-01-31")
+            self.assertEqual(sorted(token_usage.aggregate_usage(base_dir=tmp_path)),
+                             ["2026-01-01", "2026-01-20"])
+
 
 class TestReporting(unittest.TestCase):
     """Tests for CLI reporting output."""
@@ -190,13 +928,78 @@ class TestReporting(unittest.TestCase):
         self.assertIn("SUMMARY STATISTICS", text)
         self.assertIn("All Time", text)
 
+    def test_daily_series_windows(self) -> None:
+        """Verifies prefix-sum windows, changes and the windowed summary."""
+        end = date(2026, 3, 31)
+        stats = token_usage.UsageTable()
+        rng = random.Random(24)
+        for _ in range(200):
+            d = end - timedelta(days=rng.randrange(0, 120))
+            stats.add(d.isoformat(), rng.choice(["gemini-3-pro", "gemini-3-flash"]),
+                      "s", rng.randrange(1, 1000), 0, 10, rng.randrange(1, 50) / 8)
+        stats.add("unknown", "gemini-3-pro", "s", 5, 0, 0, 1.0)
+
+        series = token_usage.DailySeries(stats, end=end)
+        self.assertEqual(series.models, ["gemini-3-flash", "gemini-3-pro"])
+        for model in ("", "gemini-3-pro"):
+            for days, offset in ((1, 0), (7, 0), (7, 7), (30, 3), (500, 0)):
+                with self.subTest(model=model, days=days, offset=offset):
+                    first = end - timedelta(days=offset + days - 1)
+                    last = end - timedelta(days=offset)
+                    rows = [s for d, models in stats.items() if d != "unknown"
+                            and first.isoformat() <= d <= last.isoformat()
+                            for m, s in models.items() if model in ("", m)]
+                    usage_days, tokens, cost = series.window(days, model, offset)
+                    self.assertEqual(tokens, sum(s.input_tokens + s.output_tokens
+                                                 for s in rows))
+                    self.assertAlmostEqual(cost, sum(s.cost for s in rows))
+        self.assertEqual(series.window()[0], len(stats) - 1)
+        self.assertEqual(series.window(7, "missing"), (0, 0, 0.0))
+
+        week, previous = series.window(7)[2], series.window(7, offset=7)[2]
+        self.assertAlmostEqual(series.change(7), week / previous - 1)
+        self.assertIsNone(token_usage.DailySeries(stats, end=end + timedelta(
+            days=400)).change(7))
+
+        output = io.StringIO()
+        with patch("sys.stdout", output):
+            token_usage.print_summary_statistics(stats, show_models=True,
+                                                 windows=[7, 90])
+        text = output.getvalue()
+        self.assertIn("Last 90 Days", text)
+        self.assertIn("MA90 COST/D", text)
+        self.assertNotIn("Last 30 Days", text)
+
+        # "Last N Days" keeps its original cutoff: today - N inclusive
+        today = datetime.now().date()
+        pinned = token_usage.UsageTable()
+        for days_ago, cost in ((0, 1.0), (7, 2.0), (8, 4.0), (30, 8.0), (31, 16.0)):
+            pinned.add((today - timedelta(days=days_ago)).isoformat(),
+                       "gemini-3-pro", "s", 100, 0, 0, cost)
+        output = io.StringIO()
+        with patch("sys.stdout", output):
+            token_usage.print_summary_statistics(pinned)
+        rows = {line[:15].strip(): line[15:].split()
+                for line in output.getvalue().splitlines()
+                if line.startswith(("All Time", "Last"))}
+        self.assertEqual(rows["All Time"][:3], ["5", "500", "$"])
+        self.assertEqual(rows["Last 7 Days"][:4], ["2", "200", "$", "3.00"])
+        self.assertEqual(rows["Last 30 Days"][:4], ["4", "400", "$", "15.00"])
+
+        with self.assertRaises(Exception):
+            token_usage._parse_windows("7,0")
+        self.assertEqual(token_usage._parse_windows("7,30,90"), [7, 30, 90])
+
     def test_main_cli_dispatch(self) -> None:
         """Verifies the main function executes with mocked arguments."""
         with patch("argparse.ArgumentParser.parse_args") as mock_args:
             mock_args.return_value = MagicMock(
                 model=False, raw=True, today=True, yesterday=False,
                 this_week=False, last_week=False, this_month=False,
-                last_month=False, date_range=None
+                last_month=False, date_range=None, jobs=1, store="json",
+                trust_dir_mtime=False, watch=False, profile=None, root=None,
+                by_root=False, cache_root=None, command=None,
+                no_daemon=True
             )
             with patch("token_usage.aggregate_usage") as mock_agg:
                 mock_agg.return_value = {}
@@ -205,6 +1008,51 @@ class TestReporting(unittest.TestCase):
                     token_usage.main()
                 self.assertEqual(output.getvalue().strip(), "0")
 
+    def test_export_metrics(self) -> None:
+        """Verifies the Prometheus textfile, once and in loop mode."""
+        stats = token_usage.UsageTable()
+        stats.add("2026-01-20", "gemini-3-flash", "s1", 10, 2, 3, 0.5)
+        stats.add("2026-01-21", "gemini-3-flash", "s2", 5, 0, 1, 0.25)
+        stats.add("2026-01-21", 'odd"model', "s2", 1, 0, 0, 0.125)
+        text = token_usage.format_metrics(stats)
+        self.assertIn('gemini_tokens_total{model="gemini-3-flash",kind="input"} 15\n',
+                      text)
+        self.assertIn('gemini_tokens_total{model="gemini-3-flash",kind="output"} 4\n',
+                      text)
+        self.assertIn('gemini_cost_usd_total{model="odd\\"model"} 0.125\n', text)
+        self.assertIn("# TYPE gemini_cost_usd_total counter\n", text)
+
+        with TemporaryDirectory() as tmpdirname:
+            textfile = Path(tmpdirname) / "gemini.prom"
+            base = dict(jobs=1, store="json", trust_dir_mtime=False,
+                        cache_root=None, root=[Path(tmpdirname) / "none"],
+                        textfile=textfile)
+            token_usage.export_metrics(MagicMock(loop=None, **base))
+            self.assertIn("# TYPE gemini_tokens_total counter",
+                          textfile.read_text())
+
+            # The loop rewrites the file only when the watcher has changes
+            watcher = MagicMock(generation=0, stats=stats)
+            waits = []
+
+            def wait(timeout):
+                waits.append(timeout)
+                if len(waits) == 2:
+                    watcher.generation += 1
+                    watcher.stats = token_usage.UsageTable()
+                elif len(waits) == 4:
+                    raise KeyboardInterrupt
+            watcher.wait.side_effect = wait
+            with patch("token_usage.UsageWatcher", return_value=watcher), \
+                    patch("token_usage.write_textfile",
+                          wraps=token_usage.write_textfile) as write:
+                token_usage.export_metrics(MagicMock(loop=15.0, **base))
+            self.assertEqual(write.call_count, 2)
+            self.assertEqual(waits, [15.0] * 4)
+            watcher.close.assert_called_once()
+            self.assertNotIn("gemini-3-flash", textfile.read_text())
+            self.assertEqual(os.listdir(tmpdirname), ["gemini.prom"])
+
 
 if __name__ == "__main__":
     unittest.main()
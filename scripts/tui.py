@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 """Interactive Terminal User Interface for Gemini Token Usage."""
 
+import argparse
 import curses
 import json
 import os
 import subprocess
+import threading
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import token_usage
+import usage_daemon
 
 
 class UsageTUI:
@@ -21,10 +24,23 @@ class UsageTUI:
     COL_HEADER_Y = 1
     MENU_WIDTH = 24
     MIN_TOTALS_H = 3
+    # How often the watch mode checks for changed session files
+    WATCH_POLL_MS = 1000
+    # How often the progress line updates while a scan is running
+    LOAD_POLL_MS = 100
+    # Rows rendered above and below the visible part of the table
+    RENDER_MARGIN = 50
 
-    def __init__(self):
-        """Initializes the TUI state."""
+    def __init__(self, watch: bool = False):
+        """Initializes the TUI state.
+
+        Args:
+            watch: Keep the stats live with a token_usage.UsageWatcher
+                   instead of reloading them only on demand.
+        """
         self.stats: Dict[str, Dict[str, Any]] = {}
+        self.watch = watch
+        self.watcher: Optional[token_usage.UsageWatcher] = None
         self.current_filter = "all"
         self.show_models = False
         self.running = True
@@ -33,6 +49,7 @@ class UsageTUI:
         self.view_rows: List[List[str]] = []
         self.view_data: List[Tuple[str, Union[str, Tuple[str, str]]]] = []
         self.col_widths: List[int] = []
+        self.line_width = 0
         self.totals: Dict[str, Union[int, float]] = {
             "input": 0, "cached": 0, "output": 0, "cost": 0.0
         }
@@ -43,25 +60,169 @@ class UsageTUI:
         ]
         self.show_filter_menu = False
         self.menu_selected = 0
+        # Drill-down popup: title, column header and one line per session
+        self.drilldown: Optional[Tuple[str, str, List[str]]] = None
+        self.drill_scroll = 0
+        # Session index of the last load outside watch mode; built on the
+        # loader thread, which may wait for the cache lock
+        self._session_index: Dict[str, List[List[Any]]] = {}
+        # The pad holds view_data[pad_top:pad_top + pad_rows] only
         self.table_pad: Optional[Any] = None
+        self.pad_top = 0
+        self.pad_rows = 0
+        self.pad_selected = 0
+        # Background scan state, see load_data()
+        self.loader: Optional[threading.Thread] = None
+        self.progress: Optional[token_usage.ScanProgress] = None
+        self._loaded: Optional[Tuple[Dict[str, Dict[str, Any]],
+                                     Optional[token_usage.UsageWatcher],
+                                     Dict[str, List[List[Any]]]]] = None
+        self._load_error: Optional[BaseException] = None
+        self._view_dirty = False
+        # View models by (filter, date range, show_models, stats_generation)
+        self.stats_generation = 0
+        self._view_cache: Dict[Tuple[Any, ...], Tuple[Any, ...]] = {}
+
+    @property
+    def loading(self) -> bool:
+        """Whether a background scan is running or not yet applied."""
+        return self.loader is not None
 
     def load_data(self) -> None:
-        """Loads usage data and refreshes the view."""
-        self.stats = token_usage.aggregate_usage()
+        """Starts loading usage data on a worker thread.
+
+        The current stats stay on screen until poll_loader() swaps in the
+        new ones, and the scan can be cancelled through self.progress.
+        Outside watch mode, a running usage daemon answers instead of a
+        scan. Does nothing while a load is already running.
+        """
+        if self.loader is not None:
+            return
+        self.progress = token_usage.ScanProgress()
+        self._loaded = None
+        self._load_error = None
+        self.loader = threading.Thread(target=self._load_worker,
+                                       args=(self.progress,), daemon=True)
+        self.loader.start()
+
+    def _load_worker(self, progress: token_usage.ScanProgress) -> None:
+        """Runs a scan and leaves its result for poll_loader()."""
+        try:
+            if self.watch:
+                watcher = self.watcher
+                if watcher is None:
+                    watcher = token_usage.UsageWatcher(jobs=None)
+                    try:
+                        watcher.start(progress)
+                    except BaseException:
+                        watcher.close()
+                        raise
+                else:
+                    watcher.refresh(progress=progress)
+                # The watcher keeps its own session index in memory
+                self._loaded = (watcher.stats, watcher, {})
+            else:
+                stats = usage_daemon.fetch_stats()
+                if stats is None:
+                    stats = token_usage.aggregate_usage(jobs=None,
+                                                        progress=progress)
+                self._loaded = (stats, None, token_usage.load_session_index())
+        except token_usage.ScanCancelled:
+            pass
+        except Exception as e:  # pylint: disable=broad-except
+            self._load_error = e
+
+    def poll_loader(self, wait: bool = False) -> None:
+        """Applies the result of a finished background load.
+
+        Args:
+            wait: Block until the load finishes instead of returning while
+                  it is still running.
+        """
+        if self.loader is None:
+            return
+        if wait:
+            self.loader.join()
+        elif self.loader.is_alive():
+            return
+        self.loader = None
+        error, self._load_error = self._load_error, None
+        loaded, self._loaded = self._loaded, None
+        if error is not None:
+            raise error
+        if loaded is not None:
+            stats, watcher, self._session_index = loaded
+            self.set_stats(stats)
+            if self.watch:
+                self.watcher = watcher
+        elif not self._view_dirty:
+            return
+        self._view_dirty = False
         self.refresh_view_data()
+        self.selected_row = max(0, min(self.selected_row,
+                                       len(self.view_data) - 1))
+        self.table_pad = None
+
+    def cancel_load(self) -> None:
+        """Cancels a running load and keeps the current stats."""
+        if self.progress is not None:
+            self.progress.cancel()
+        self.poll_loader(wait=True)
+
+    def poll_watcher(self) -> None:
+        """Applies pending session file changes in watch mode."""
+        if self.watcher is not None and self.watcher.wait(timeout=0):
+            # The watcher updated self.stats in place
+            self.set_stats(self.watcher.stats)
+            self.refresh_view_data()
+            self.selected_row = max(0, min(self.selected_row,
+                                           len(self.view_data) - 1))
+            self.table_pad = None
+
+    def set_stats(self, stats: Dict[str, Dict[str, Any]]) -> None:
+        """Installs new or changed stats and drops the cached view models."""
+        self.stats = stats
+        self.stats_generation += 1
+        self._view_cache.clear()
+
+    def refresh_view(self) -> None:
+        """Rebuilds the view after a filter or layout change.
+
+        A watcher being refreshed on the loader thread updates its stats
+        in place, so the rebuild then waits for poll_loader().
+        """
+        if self.loading and self.watcher is not None:
+            self._view_dirty = True
+        else:
+            self.refresh_view_data()
+        self.table_pad = None
 
     def refresh_view_data(self) -> None:
-        """Processes raw stats into displayable rows and calculates column widths."""
+        """Processes raw stats into displayable rows and calculates column widths.
+
+        The result is cached per filter, model toggle and stats_generation,
+        so switching back to a view only reassigns it. Stats must be
+        replaced through set_stats() for the cache to notice.
+        """
+        start, end = None, None
+        if self.current_filter != "all":
+            start, end = token_usage.get_date_range(self.current_filter)
+        key = (self.current_filter, start, end, self.show_models,
+               self.stats_generation)
+        cached = self._view_cache.get(key)
+        if cached is not None:
+            (self.view_rows, self.view_data, self.col_widths, self.line_width,
+             self.totals, self.model_totals) = cached
+            return
+
         self.view_rows = []
         self.view_data = []
         self.totals = {"input": 0, "cached": 0, "output": 0, "cost": 0.0}
         self.model_totals = {}
 
         filtered_stats = self.stats
-        if self.current_filter != "all":
-            start, end = token_usage.get_date_range(self.current_filter)
-            if start and end:
-                filtered_stats = token_usage.filter_stats(self.stats, start, end)
+        if start and end:
+            filtered_stats = token_usage.filter_stats(self.stats, start, end)
 
         # 1. Aggregate totals and model-specific totals
         for day in sorted(filtered_stats.keys(), reverse=True):
@@ -89,26 +250,20 @@ class UsageTUI:
             if day == "unknown":
                 continue
             if not self.show_models:
-                day_models = filtered_stats[day].values()
-                inp = sum(s.input_tokens for s in day_models)
-                cache = sum(s.cached_tokens for s in day_models)
-                out = sum(s.output_tokens for s in day_models)
-                cost = sum(s.cost for s in day_models)
-                sess: Set[str] = set()
-                for s in day_models:
-                    sess.update(s.sessions)
+                sess, inp, cache, out, cost = token_usage.day_totals(
+                    filtered_stats[day])
                 
                 total = inp + cache + out
                 self.view_rows.append([
-                    day, str(len(sess)), f"{inp:,}", f"{cache:,}", 
+                    day, str(sess), f"{inp:,}", f"{cache:,}", 
                     f"{out:,}", f"{total:,}", f"${cost:,.2f}"
                 ])
             else:
-                for model in sorted(filtered_stats[day].keys()):
-                    s = filtered_stats[day][model]
+                for model, s in sorted(filtered_stats[day].items(),
+                                       key=lambda item: item[0]):
                     total = s.input_tokens + s.cached_tokens + s.output_tokens
                     self.view_rows.append([
-                        day, model, str(len(s.sessions)), f"{s.input_tokens:,}", 
+                        day, model, str(s.session_count), f"{s.input_tokens:,}", 
                         f"{s.cached_tokens:,}", f"{s.output_tokens:,}", f"{total:,}", 
                         f"${s.cost:,.2f}"
                     ])
@@ -137,6 +292,11 @@ class UsageTUI:
                 align = "<" if i < (2 if self.show_models else 1) else ">"
                 line += f"{val:{align}{self.col_widths[i]}}  "
             self.view_data.append((line.rstrip(), row[0]))
+        self.line_width = max((len(line) for line, _ in self.view_data),
+                              default=0)
+        self._view_cache[key] = (self.view_rows, self.view_data,
+                                 self.col_widths, self.line_width,
+                                 self.totals, self.model_totals)
 
     def draw_header(self, stdscr: Any) -> None:
         """Draws the top status bar."""
@@ -232,10 +392,71 @@ class UsageTUI:
         
         win.refresh()
 
+    def open_drilldown(self) -> None:
+        """Lists the sessions behind the selected row, by cost.
+
+        Never touches the usage cache: the index comes with each load, or
+        from the watcher's memory in watch mode.
+        """
+        if self.loading or not self.view_rows:
+            # The loader thread may be replacing the index or the watcher
+            return
+        row = self.view_rows[self.selected_row]
+        model = row[1] if self.show_models else None
+        if self.watcher is not None:
+            index = {row[0]: self.watcher.session_rows(row[0])}
+        else:
+            index = self._session_index
+        sessions = token_usage.session_breakdown(index, row[0], model)
+        title = f"{row[0]} {model}" if model else row[0]
+
+        rows = [(sid, f"{inp:,}", f"{cached:,}", f"{out:,}",
+                 f"{inp + cached + out:,}", f"${cost:,.4f}")
+                for sid, inp, cached, out, cost in sessions]
+        header = ("SESSION", "INPUT", "CACHED", "OUTPUT", "TOTAL", "COST")
+        widths = [max([len(header[i])] + [len(r[i]) for r in rows])
+                  for i in range(len(header))]
+
+        def fmt(cols: Tuple[str, ...]) -> str:
+            return "  ".join(f"{c:{'<' if i == 0 else '>'}{widths[i]}}"
+                             for i, c in enumerate(cols))
+
+        self.drilldown = (f"{title} ({len(rows)})", fmt(header),
+                          [fmt(r) for r in rows])
+        self.drill_scroll = 0
+
+    def draw_drilldown(self, stdscr: Any) -> None:
+        """Draws the visible part of the drill-down session list."""
+        h, w = stdscr.getmaxyx()
+        title, header, lines = self.drilldown
+        win_h = max(4, h - 4)
+        win_w = max(10, w - 4)
+        win = curses.newwin(win_h, win_w, 2, 2)
+        win.box()
+        win.attron(curses.A_BOLD)
+        win.addstr(0, 2, f" Sessions: {title} "[:win_w - 4])
+        win.attroff(curses.A_BOLD)
+        win.addstr(1, 1, header[:win_w - 2])
+        visible = win_h - 3
+        self.drill_scroll = max(0, min(self.drill_scroll,
+                                       len(lines) - visible))
+        for y, line in enumerate(lines[self.drill_scroll:
+                                       self.drill_scroll + visible]):
+            win.addstr(y + 2, 1, line[:win_w - 2])
+        win.refresh()
+
     def draw_footer(self, stdscr: Any) -> None:
         """Draws the bottom command legend."""
         h, w = stdscr.getmaxyx()
-        footer = " [Q] Quit | [R] Refresh | [M] Models | [F] Filter | [P] Pricing | [UP/DOWN] Select "
+        footer = " [Q] Quit | [R] Refresh | [M] Models | [F] Filter | [P] Pricing | [UP/DOWN] Select | [ENTER] Sessions "
+        if self.drilldown is not None:
+            footer = " [ESC/ENTER] Back | [UP/DOWN] Scroll "
+        if self.loading and self.progress is not None:
+            p = self.progress
+            scanned = (f"{p.files_scanned:,}/{p.files_total:,}"
+                       if p.files_total else "...")
+            footer = (f" Scanning {scanned} files (cache hits "
+                      f"{p.cache_hits:,}) | [C] Cancel | [Q] Quit ")
         stdscr.attron(curses.A_REVERSE)
         try:
             stdscr.addstr(h - 1, 0, footer.ljust(w)[:w-1])
@@ -259,6 +480,11 @@ class UsageTUI:
         curses.reset_shell_mode()
         
         token_usage.reload_config()
+        self.cancel_load()
+        if self.watcher is not None:
+            # Restart so that cached costs are repriced
+            self.watcher.close()
+            self.watcher = None
         self.load_data()
         self.table_pad = None
 
@@ -274,17 +500,36 @@ class UsageTUI:
                 self.show_filter_menu = False
                 self.selected_row = 0
                 self.scroll_y = 0
-                self.refresh_view_data()
-                self.table_pad = None
+                self.refresh_view()
             elif key in [27, ord('f'), ord('F')]:
                 self.show_filter_menu = False
             return
 
+        if self.drilldown is not None:
+            if key == curses.KEY_UP:
+                self.drill_scroll = max(0, self.drill_scroll - 1)
+            elif key == curses.KEY_DOWN:
+                self.drill_scroll += 1
+            elif key == curses.KEY_PPAGE:
+                self.drill_scroll = max(0, self.drill_scroll - 10)
+            elif key == curses.KEY_NPAGE:
+                self.drill_scroll += 10
+            elif key in [10, 13, 27, curses.KEY_ENTER, curses.KEY_BACKSPACE]:
+                self.drilldown = None
+            if key not in [ord('q'), ord('Q')]:
+                return
+
         if key in [ord('q'), ord('Q')]:
+            if self.progress is not None:
+                self.progress.cancel()
             self.running = False
+        elif key in [ord('c'), ord('C'), 27]:
+            if self.loading:
+                self.cancel_load()
+        elif key in [10, 13, curses.KEY_ENTER]:
+            self.open_drilldown()
         elif key in [ord('r'), ord('R')]:
             self.load_data()
-            self.table_pad = None
         elif key in [ord('p'), ord('P')]:
             self.edit_pricing(stdscr)
         elif key in [ord('f'), ord('F')]:
@@ -294,8 +539,7 @@ class UsageTUI:
             self.show_models = not self.show_models
             self.selected_row = 0
             self.scroll_y = 0
-            self.refresh_view_data()
-            self.table_pad = None
+            self.refresh_view()
         elif key == curses.KEY_UP:
             self.selected_row = max(0, self.selected_row - 1)
         elif key == curses.KEY_DOWN:
@@ -305,16 +549,70 @@ class UsageTUI:
         elif key == curses.KEY_NPAGE:
             self.selected_row = min(len(self.view_data) - 1, self.selected_row + 10)
 
+    def render_table(self, table_h: int, w: int) -> None:
+        """Brings the table pad up to date for the current scroll position.
+
+        Only the visible rows plus RENDER_MARGIN on either side live in the
+        pad. It is rebuilt when the view scrolls out of it or table_pad was
+        reset, and otherwise a selection move redraws just two rows, so the
+        cost of a keypress does not grow with len(view_data).
+
+        Args:
+            table_h: Number of table rows on screen.
+            w: Screen width.
+        """
+        total = len(self.view_data)
+        bottom = min(self.scroll_y + table_h, total)
+        if (self.table_pad is not None and self.pad_top <= self.scroll_y
+                and bottom <= self.pad_top + self.pad_rows):
+            if self.pad_selected != self.selected_row:
+                self._draw_row(self.pad_selected)
+                self._draw_row(self.selected_row)
+                self.pad_selected = self.selected_row
+            return
+
+        self.pad_top = max(0, self.scroll_y - self.RENDER_MARGIN)
+        self.pad_rows = min(total - self.pad_top,
+                            table_h + 2 * self.RENDER_MARGIN)
+        # Tall and wide enough for the screen area it is copied to, plus
+        # one spare row and column as curses refuses to write the last cell
+        rows = max(self.pad_rows, self.scroll_y - self.pad_top + table_h, 1)
+        self.table_pad = curses.newpad(rows + 1,
+                                       max(self.line_width, w) + 1)
+        self.pad_selected = self.selected_row
+        for i in range(self.pad_top, self.pad_top + self.pad_rows):
+            self._draw_row(i)
+
+    def _draw_row(self, i: int) -> None:
+        """Draws view_data[i] into the pad if it holds that row."""
+        if not self.pad_top <= i < self.pad_top + self.pad_rows:
+            return
+        attr = curses.A_REVERSE if i == self.selected_row else curses.A_NORMAL
+        line = self.view_data[i][0]
+        self.table_pad.addstr(i - self.pad_top, 0,
+                              line.ljust(self.line_width), attr)
+
     def main_loop(self, stdscr: Any) -> None:
         """Core application loop."""
         curses.curs_set(0)
         stdscr.keypad(True)
         stdscr.nodelay(False)
-        
+        timeout = None
+
+        # Column widths for the empty view shown until the first load ends
+        self.refresh_view_data()
         self.load_data()
         self.table_pad = None
         
         while self.running:
+            if self.loading:
+                wanted = self.LOAD_POLL_MS
+            else:
+                wanted = self.WATCH_POLL_MS if self.watch else -1
+            if wanted != timeout:
+                stdscr.timeout(wanted)
+                timeout = wanted
+
             stdscr.erase()
             self.draw_header(stdscr)
             self.draw_footer(stdscr)
@@ -342,43 +640,54 @@ class UsageTUI:
             except curses.error:
                 pass
 
-            # 3. Handle pad creation and data rendering
-            if not self.table_pad:
-                self.table_pad = curses.newpad(max(len(self.view_data) + 1, 100), 256)
-            
-            self.table_pad.erase()
-            for i, (line, _) in enumerate(self.view_data):
-                if i == self.selected_row:
-                    self.table_pad.attron(curses.A_REVERSE)
-                self.table_pad.addstr(i, 0, line)
-                if i == self.selected_row:
-                    self.table_pad.attroff(curses.A_REVERSE)
-            
-            # 4. Sync scrolling
+            # 3. Sync scrolling
             if self.selected_row < self.scroll_y:
                 self.scroll_y = self.selected_row
             elif self.selected_row >= self.scroll_y + table_h:
                 self.scroll_y = self.selected_row - table_h + 1
 
+            # 4. Render the visible rows into the pad
+            self.render_table(max(table_h, 0), w)
+
             # 5. Refresh screen
             stdscr.noutrefresh()
             if table_h > 0:
-                self.table_pad.noutrefresh(self.scroll_y, 0, table_y_start, 0, table_y_end, w - 1)
+                self.table_pad.noutrefresh(self.scroll_y - self.pad_top, 0,
+                                           table_y_start, 0, table_y_end, w - 1)
             
             self.draw_totals(stdscr, h - totals_h - 1, totals_h)
             
             if self.show_filter_menu:
                 self.draw_filter_menu(stdscr)
+            elif self.drilldown is not None:
+                self.draw_drilldown(stdscr)
             
             curses.doupdate()
             
-            # 6. Process input
-            self.handle_input(stdscr.getch(), stdscr)
+            # 6. Process input; a timeout polls the loader or the watcher
+            key = stdscr.getch()
+            if key == -1:
+                self.poll_loader()
+                if self.watch and not self.loading:
+                    self.poll_watcher()
+            else:
+                self.handle_input(key, stdscr)
+
+        self.cancel_load()
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
 
 
 def main() -> None:
     """TUI Entry point."""
-    tui = UsageTUI()
+    parser = argparse.ArgumentParser(
+        description="Interactive Gemini token usage viewer.")
+    parser.add_argument("--watch",
+                        action="store_true",
+                        help="Update the view as session files change.")
+    args = parser.parse_args()
+    tui = UsageTUI(watch=args.watch)
     curses.wrapper(tui.main_loop)
 
 
@@ -3,6 +3,7 @@
 
 import sys
 import os
+import threading
 import unittest
 from unittest.mock import MagicMock, patch
 
@@ -17,6 +18,14 @@ class TestUsageTUI(unittest.TestCase):
 
     def setUp(self) -> None:
         self.tui = tui.UsageTUI()
+        # Never talk to a usage daemon of the machine running the tests
+        daemon = patch("usage_daemon.fetch_stats", return_value=None)
+        self.fetch_stats = daemon.start()
+        self.addCleanup(daemon.stop)
+        # Nor read the session index next to its usage cache
+        index = patch("token_usage.load_session_index", return_value={})
+        self.load_index = index.start()
+        self.addCleanup(index.stop)
 
     @patch("curses.wrapper")
     def test_tui_init_state(self, mock_wrapper: MagicMock) -> None:
@@ -56,6 +65,232 @@ class TestUsageTUI(unittest.TestCase):
         mock_newpad.assert_called()
         self.assertFalse(self.tui.running)
 
+    @patch("token_usage.UsageWatcher")
+    @patch("curses.newpad")
+    @patch("curses.newwin")
+    @patch("curses.curs_set")
+    @patch("curses.doupdate")
+    def test_watch_mode_polls_on_timeout(self, mock_doupdate, mock_curs_set,
+                                         mock_newwin, mock_newpad,
+                                         mock_watcher_cls) -> None:
+        """Verifies that getch timeouts apply watched changes to the view."""
+        watcher = mock_watcher_cls.return_value
+        watcher.stats = {}
+
+        def change() -> None:
+            watcher.stats["2026-02-05"] = {
+                "gemini-3-flash": token_usage.ModelStats(input_tokens=7)}
+        watcher.wait.side_effect = lambda timeout: change() or True
+
+        mock_stdscr = MagicMock()
+        mock_stdscr.getmaxyx.return_value = (24, 80)
+        # Time out until the loaded watcher has been polled once
+        mock_stdscr.getch.side_effect = (
+            lambda: ord('q') if watcher.wait.called else -1)
+
+        self.tui = tui.UsageTUI(watch=True)
+        self.tui.main_loop(mock_stdscr)
+
+        mock_stdscr.timeout.assert_called_with(tui.UsageTUI.WATCH_POLL_MS)
+        watcher.start.assert_called_once()
+        watcher.wait.assert_called_once_with(timeout=0)
+        watcher.close.assert_called_once()
+        self.assertEqual(len(self.tui.view_rows), 1)
+
+    @patch("token_usage.aggregate_usage")
+    @patch("curses.newpad")
+    @patch("curses.newwin")
+    @patch("curses.curs_set")
+    @patch("curses.doupdate")
+    def test_background_load(self, mock_doupdate, mock_curs_set, mock_newwin,
+                             mock_newpad, mock_aggregate) -> None:
+        """Verifies that loads run off the main loop and can be cancelled."""
+        release = threading.Event()
+        stats = {"2026-02-05": {
+            "gemini-3-flash": token_usage.ModelStats(input_tokens=7)}}
+
+        def scan(jobs, progress):
+            progress.files_total = 10
+            progress.files_scanned = progress.cache_hits = 4
+            while not release.wait(0.01):
+                progress.check()
+            return stats
+        mock_aggregate.side_effect = scan
+
+        # A scan in progress keeps the old view and shows its progress
+        self.tui.refresh_view_data()
+        self.tui.load_data()
+        self.assertTrue(self.tui.loading)
+        self.tui.poll_loader()
+        self.assertTrue(self.tui.loading)
+        self.assertEqual(self.tui.view_rows, [])
+        mock_stdscr = MagicMock()
+        mock_stdscr.getmaxyx.return_value = (24, 80)
+        self.tui.draw_footer(mock_stdscr)
+        footer = mock_stdscr.addstr.call_args[0][2]
+        self.assertIn("Scanning 4/10 files (cache hits 4)", footer)
+
+        # A second load request while scanning is ignored
+        self.tui.load_data()
+        mock_aggregate.assert_called_once()
+
+        # Cancelling keeps the old stats
+        self.tui.handle_input(ord('c'), mock_stdscr)
+        self.assertFalse(self.tui.loading)
+        self.assertEqual(self.tui.stats, {})
+
+        # A finished scan is swapped in by the poll
+        self.tui.load_data()
+        release.set()
+        self.tui.loader.join()
+        self.assertEqual(self.tui.view_rows, [])
+        self.tui.poll_loader()
+        self.assertFalse(self.tui.loading)
+        self.assertIs(self.tui.stats, stats)
+        self.assertEqual(len(self.tui.view_rows), 1)
+
+    @patch("token_usage.aggregate_usage")
+    @patch("curses.newpad")
+    @patch("curses.newwin")
+    @patch("curses.curs_set")
+    @patch("curses.doupdate")
+    def test_quit_during_scan(self, mock_doupdate, mock_curs_set, mock_newwin,
+                              mock_newpad, mock_aggregate) -> None:
+        """Verifies that quitting cancels a running scan."""
+        def scan(jobs, progress):
+            while True:
+                progress.check()
+                threading.Event().wait(0.01)
+        mock_aggregate.side_effect = scan
+
+        mock_stdscr = MagicMock()
+        mock_stdscr.getmaxyx.return_value = (24, 80)
+        mock_stdscr.getch.side_effect = [-1, ord('q')]
+        self.tui.main_loop(mock_stdscr)
+
+        mock_stdscr.timeout.assert_called_once_with(tui.UsageTUI.LOAD_POLL_MS)
+        self.assertIsNone(self.tui.loader)
+        self.assertTrue(self.tui.progress.cancelled)
+
+    @patch("curses.newpad")
+    def test_render_table_window(self, mock_newpad) -> None:
+        """Verifies that only the visible rows and a margin are rendered."""
+        self.tui.view_data = [(f"row {i}", "2026-02-05") for i in range(10000)]
+        self.tui.view_data[3] = ("x" * 300, "2026-02-05")
+        self.tui.line_width = 300
+        pad = mock_newpad.return_value
+        window = 20 + 2 * tui.UsageTUI.RENDER_MARGIN
+
+        self.tui.render_table(20, 80)
+        mock_newpad.assert_called_once_with(window + 1, 301)
+        self.assertEqual(pad.addstr.call_count, window)
+
+        # A selection move redraws the old and the new row only
+        pad.addstr.reset_mock()
+        self.tui.selected_row = 1
+        self.tui.render_table(20, 80)
+        self.assertEqual(mock_newpad.call_count, 1)
+        self.assertEqual([c[0][0] for c in pad.addstr.call_args_list], [0, 1])
+
+        # Scrolling past the margin renders a new window
+        pad.addstr.reset_mock()
+        self.tui.selected_row = self.tui.scroll_y = 5000
+        self.tui.render_table(20, 80)
+        self.assertEqual(mock_newpad.call_count, 2)
+        self.assertEqual(self.tui.pad_top, 5000 - tui.UsageTUI.RENDER_MARGIN)
+        self.assertEqual(pad.addstr.call_count, window)
+
+    @patch("token_usage.aggregate_usage")
+    def test_load_from_daemon(self, mock_aggregate) -> None:
+        """Verifies that a running daemon answers loads instead of a scan."""
+        stats = {"2026-02-05": {
+            "gemini-3-flash": token_usage.ModelStats(input_tokens=7)}}
+        self.fetch_stats.return_value = stats
+        self.tui.load_data()
+        self.tui.poll_loader(wait=True)
+        self.assertIs(self.tui.stats, stats)
+        mock_aggregate.assert_not_called()
+
+    @patch("token_usage.filter_stats")
+    def test_view_model_cache(self, mock_filter) -> None:
+        """Verifies that toggling views reuses view models until stats change."""
+        stats = {"2026-02-05": {
+            "gemini-3-flash": token_usage.ModelStats(input_tokens=7)}}
+        mock_filter.return_value = stats
+        self.tui.set_stats(stats)
+        self.tui.refresh_view_data()
+        plain = self.tui.view_data
+        mock_stdscr = MagicMock()
+        for key in [ord('m'), ord('m')]:
+            self.tui.handle_input(key, mock_stdscr)
+        self.assertIs(self.tui.view_data, plain)
+
+        self.tui.current_filter = "today"
+        self.tui.refresh_view_data()
+        self.tui.current_filter = "all"
+        self.tui.refresh_view_data()
+        self.tui.current_filter = "today"
+        self.tui.refresh_view_data()
+        mock_filter.assert_called_once()
+
+        # New stats invalidate every cached view
+        stats["2026-02-05"]["gemini-3-pro"] = token_usage.ModelStats(
+            output_tokens=1)
+        self.tui.set_stats(stats)
+        self.tui.show_models = True
+        self.tui.current_filter = "all"
+        self.tui.refresh_view_data()
+        self.assertEqual(len(self.tui.view_rows), 2)
+
+    @patch("token_usage.aggregate_usage")
+    @patch("curses.KEY_ENTER", 343)
+    def test_drilldown(self, mock_aggregate) -> None:
+        """Verifies that Enter lists the sessions of the selected row."""
+        loader_threads = []
+
+        def index() -> dict:
+            loader_threads.append(threading.current_thread())
+            return {"2026-02-05": [
+                ["cheap", "gemini-3-flash", 10, 0, 1, 0.01],
+                ["pricey", "gemini-3-pro", 500, 0, 9, 2.5],
+                ["cheap", "gemini-3-pro", 20, 0, 2, 0.02],
+            ]}
+        self.load_index.side_effect = index
+        mock_aggregate.return_value = {"2026-02-05": {
+            "gemini-3-flash": token_usage.ModelStats(input_tokens=10),
+            "gemini-3-pro": token_usage.ModelStats(input_tokens=520)}}
+        self.tui.load_data()
+        self.tui.poll_loader(wait=True)
+        # The index is loaded with the stats, never on the UI thread
+        self.assertNotIn(threading.current_thread(), loader_threads)
+        mock_stdscr = MagicMock()
+
+        self.tui.handle_input(10, mock_stdscr)
+        title, _, lines = self.tui.drilldown
+        self.assertEqual(title, "2026-02-05 (2)")
+        self.assertTrue(lines[0].startswith("pricey"))
+        self.assertIn("30", lines[1])
+        self.tui.handle_input(27, mock_stdscr)
+        self.assertIsNone(self.tui.drilldown)
+
+        # Per-model rows only count their model; the index is loaded once
+        self.tui.handle_input(ord('m'), mock_stdscr)
+        self.tui.handle_input(10, mock_stdscr)
+        title, _, lines = self.tui.drilldown
+        self.assertEqual(title, "2026-02-05 gemini-3-flash (1)")
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(len(loader_threads), 1)
+        self.tui.handle_input(27, mock_stdscr)
+
+        # In watch mode the rows come from the watcher's memory
+        self.tui.watcher = MagicMock()
+        self.tui.watcher.session_rows.return_value = [
+            ["live", "gemini-3-flash", 1, 0, 0, 0.5]]
+        self.tui.handle_input(10, mock_stdscr)
+        self.assertEqual(self.tui.drilldown[0], "2026-02-05 gemini-3-flash (1)")
+        self.tui.watcher.session_rows.assert_called_once_with("2026-02-05")
+        self.assertEqual(len(loader_threads), 1)
+
     @patch("curses.KEY_DOWN", 258)
     @patch("curses.KEY_ENTER", 10)
     def test_filter_cycling(self) -> None:
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Keeps aggregated Gemini usage warm in memory and serves it locally.
+
+The daemon runs a token_usage.UsageWatcher, so only changed session files
+are ever reparsed, and answers queries on a Unix domain socket next to
+the usage cache. Each connection carries one request and one response,
+both a single line of JSON:
+
+    {"op": "ping"}
+        -> {"version": 1, "ok": true, "generation": 12}
+    {"op": "rows", "start_date": "2026-01-01", "end_date": null}
+        -> {"version": 1, "ok": true, "generation": 12,
+            "sessions": ["id", ...],
+            "rows": [[date, model, input, cached, output, cost,
+                      [session index, ...]], ...]}
+    {"op": "totals", "start_date": "2026-01-01", "end_date": "2026-01-31"}
+        -> {"version": 1, "ok": true, "generation": 12,
+            "totals": [sessions, input, cached, output, cost]}
+
+Errors are answered with {"version": 1, "ok": false, "error": "..."}.
+Clients use fetch_stats() or query(), which return None when no daemon
+is running so that callers can fall back to token_usage.aggregate_usage.
+"""
+
+import json
+import os
+import select
+import socket
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import token_usage
+
+SOCKET_FILE = "usage_daemon.sock"
+PROTOCOL_VERSION = 1
+# How often the daemon applies session file changes between requests
+TICK_SECONDS = 0.5
+# Clients give up, and fall back to scanning, after this long
+CLIENT_TIMEOUT = 5.0
+# A stuck client cannot hold up the daemon for longer than this
+SERVER_TIMEOUT = 2.0
+MAX_REQUEST_BYTES = 64 * 1024
+
+
+def socket_path(base_dir: Optional[Path] = None) -> Path:
+    """Returns where the daemon listens, next to the usage cache."""
+    if base_dir:
+        return Path(base_dir) / SOCKET_FILE
+    return Path.home() / ".gemini" / SOCKET_FILE
+
+
+def query(request: Dict[str, Any], base_dir: Optional[Path] = None,
+          timeout: float = CLIENT_TIMEOUT) -> Optional[Dict[str, Any]]:
+    """Sends one request to the daemon.
+
+    Returns:
+        The response, or None if no daemon of this protocol version
+        answered.
+    """
+    path = socket_path(base_dir)
+    if not path.exists():
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(path))
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = sock.recv(1 << 16)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        response = json.loads(b"".join(chunks))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(response, dict) or (
+            response.get("version") != PROTOCOL_VERSION):
+        return None
+    return response
+
+
+def fetch_stats(start_date: Optional[str] = None,
+                end_date: Optional[str] = None,
+                base_dir: Optional[Path] = None
+                ) -> Optional[token_usage.UsageTable]:
+    """Returns the daemon's stats for a date range as a UsageTable.
+
+    Args:
+        start_date: Optional first date (YYYY-MM-DD) to report.
+        end_date: Optional last date (YYYY-MM-DD) to report. When either
+                  bound is given, sessions without a date are left out.
+        base_dir: Optional root, as for aggregate_usage.
+
+    Returns:
+        The stats, as aggregate_usage would have returned them, or None
+        if no daemon is running.
+    """
+    response = query({"op": "rows", "start_date": start_date,
+                      "end_date": end_date}, base_dir)
+    if response is None or not response.get("ok"):
+        return None
+    stats = token_usage.UsageTable()
+    names = response["sessions"]
+    for date_str, model, inp, cached, out, cost, sessions in response["rows"]:
+        stats.add(date_str, model, None, inp, cached, out, cost)
+        for sid in sessions:
+            stats.add(date_str, model, names[sid], 0, 0, 0, 0.0)
+    return stats
+
+
+def _dates(stats: token_usage.UsageTable, start_date: Optional[str],
+           end_date: Optional[str]) -> List[str]:
+    """Returns the dates of stats in an optional inclusive range."""
+    if start_date is None and end_date is None:
+        return list(stats)
+    return [d for d in stats.date_slice(start_date or "", end_date or "9999")
+            if d != "unknown"]
+
+
+def handle_request(stats: token_usage.UsageTable,
+                   request: Dict[str, Any]) -> Dict[str, Any]:
+    """Answers one request from stats; see the module docstring."""
+    op = request.get("op")
+    start_date = request.get("start_date")
+    end_date = request.get("end_date")
+    if op == "ping":
+        return {"ok": True}
+    if op == "totals":
+        sessions = set()
+        totals = [0, 0, 0, 0.0]
+        for date_str in _dates(stats, start_date, end_date):
+            for s in stats[date_str].values():
+                sessions.update(s.sessions)
+                totals[0] += s.input_tokens
+                totals[1] += s.cached_tokens
+                totals[2] += s.output_tokens
+                totals[3] += s.cost
+        return {"ok": True, "totals": [len(sessions)] + totals}
+    if op == "rows":
+        names: List[str] = []
+        ids: Dict[str, int] = {}
+        rows = []
+        for date_str in _dates(stats, start_date, end_date):
+            for model, s in stats[date_str].items():
+                sessions = []
+                for name in sorted(s.sessions):
+                    if name not in ids:
+                        ids[name] = len(names)
+                        names.append(name)
+                    sessions.append(ids[name])
+                rows.append([date_str, model, s.input_tokens,
+                             s.cached_tokens, s.output_tokens, s.cost,
+                             sessions])
+        return {"ok": True, "sessions": names, "rows": rows}
+    return {"ok": False, "error": f"unknown op {op!r}"}
+
+
+class UsageDaemon:
+    """Serves the stats of a UsageWatcher on a Unix domain socket.
+
+    Everything runs on one thread: between requests, and before each one,
+    the watcher applies pending session file changes, so answers are
+    always current and need no locking.
+    """
+
+    def __init__(self, base_dir: Optional[Path] = None,
+                 jobs: Optional[int] = 1, store: str = "json"):
+        self.path = socket_path(base_dir)
+        self.watcher = token_usage.UsageWatcher(base_dir=base_dir,
+                                                jobs=jobs, store=store)
+        self.server: Optional[socket.socket] = None
+
+    def start(self) -> None:
+        """Catches up with the session files and starts listening.
+
+        Raises:
+            RuntimeError: If another daemon already serves this socket.
+        """
+        if query({"op": "ping"}, self.path.parent) is not None:
+            raise RuntimeError(f"a daemon is already listening on {self.path}")
+        self.watcher.start()
+        self.path.unlink(missing_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            # Only the owner may connect: the stats are private usage data
+            umask = os.umask(0o177)
+            try:
+                server.bind(str(self.path))
+            finally:
+                os.umask(umask)
+            server.listen(16)
+        except BaseException:
+            server.close()
+            raise
+        self.server = server
+
+    def serve_once(self, timeout: float = TICK_SECONDS) -> bool:
+        """Applies changes and answers a request if one arrives in time.
+
+        Returns:
+            Whether a request was answered.
+        """
+        ready = select.select([self.server], [], [], timeout)[0]
+        self.watcher.wait(timeout=0)
+        if not ready:
+            return False
+        conn, _ = self.server.accept()
+        with conn:
+            conn.settimeout(SERVER_TIMEOUT)
+            try:
+                data = b""
+                while b"\n" not in data and len(data) < MAX_REQUEST_BYTES:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                try:
+                    request = json.loads(data.split(b"\n", 1)[0])
+                    if not isinstance(request, dict):
+                        raise ValueError("not an object")
+                    response = handle_request(self.watcher.stats, request)
+                except ValueError as e:
+                    response = {"ok": False, "error": f"bad request: {e}"}
+                response["version"] = PROTOCOL_VERSION
+                response["generation"] = self.watcher.generation
+                conn.sendall(json.dumps(response).encode("utf-8") + b"\n")
+            except OSError:
+                pass
+        return True
+
+    def serve_forever(self) -> None:
+        """Serves requests until interrupted."""
+        while True:
+            self.serve_once()
+
+    def close(self) -> None:
+        """Stops listening and closes the watcher."""
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            self.path.unlink(missing_ok=True)
+        self.watcher.close()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Tests for the usage daemon and its clients."""
+
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+# Add the scripts directory to path to import the modules
+sys.path.append(os.path.dirname(__file__))
+import token_usage
+import usage_daemon
+from testutil import gemini_message, summarize, write_session
+
+
+class TestUsageDaemon(unittest.TestCase):
+    """Queries against a daemon serving a temporary session tree."""
+
+    def setUp(self) -> None:
+        self.tmpdir = TemporaryDirectory()
+        self.tmp_path = Path(self.tmpdir.name)
+        self.chat_dir = self.tmp_path / "project1" / "chats"
+        self.chat_dir.mkdir(parents=True)
+        for i, (day, model, inp) in enumerate([
+                ("2026-01-20", "gemini-3-flash", 100),
+                ("2026-01-21", "gemini-2.5-pro", 200),
+                ("2026-01-21", "gemini-3-flash", 300)]):
+            write_session(self.chat_dir / f"session-{i}.json", f"s{i}",
+                          [gemini_message(model, input=inp, cached=1, output=5)],
+                          day)
+
+        self.daemon = usage_daemon.UsageDaemon(base_dir=self.tmp_path)
+        # Polling keeps the test independent of inotify
+        self.daemon.watcher.use_inotify = False
+        self.daemon.watcher.poll_interval = 0.05
+        self.daemon.start()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.start()
+
+    def serve(self) -> None:
+        while not self.stop.is_set():
+            self.daemon.serve_once(0.02)
+
+    def tearDown(self) -> None:
+        self.stop.set()
+        self.thread.join()
+        self.daemon.close()
+        self.tmpdir.cleanup()
+
+    def direct(self, start_date=None, end_date=None):
+        self.stop.set()
+        self.thread.join()
+        try:
+            return token_usage.aggregate_usage(base_dir=self.tmp_path,
+                                               start_date=start_date,
+                                               end_date=end_date)
+        finally:
+            self.stop.clear()
+            self.thread = threading.Thread(target=self.serve)
+            self.thread.start()
+
+    def test_queries_match_direct_aggregation(self) -> None:
+        """Verifies rows, totals and errors of the JSON protocol."""
+        for start_date, end_date in [(None, None), ("2026-01-21", None),
+                                     ("2026-01-20", "2026-01-20")]:
+            with self.subTest(start_date=start_date, end_date=end_date):
+                stats = usage_daemon.fetch_stats(start_date, end_date,
+                                                 self.tmp_path)
+                self.assertEqual(summarize(stats),
+                                 summarize(self.direct(start_date, end_date)))
+
+        response = usage_daemon.query({"op": "totals",
+                                       "start_date": "2026-01-21",
+                                       "end_date": "2026-01-21"},
+                                      self.tmp_path)
+        self.assertEqual(response["totals"][:4], [2, 500, 2, 10])
+        self.assertTrue(usage_daemon.query({"op": "ping"},
+                                           self.tmp_path)["ok"])
+        response = usage_daemon.query({"op": "drop"}, self.tmp_path)
+        self.assertFalse(response["ok"])
+        self.assertIn("unknown op", response["error"])
+
+    def test_changes_are_served(self) -> None:
+        """Verifies that the daemon picks up changed session files."""
+        generation = usage_daemon.query({"op": "ping"},
+                                        self.tmp_path)["generation"]
+        write_session(self.chat_dir / "session-3.json", "s3",
+                      [gemini_message(input=7, cached=1, output=5)], "2026-01-22")
+        deadline = time.monotonic() + 10
+        while usage_daemon.query({"op": "ping"}, self.tmp_path)[
+                "generation"] == generation:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.02)
+        stats = usage_daemon.fetch_stats(base_dir=self.tmp_path)
+        self.assertEqual(stats["2026-01-22"]["gemini-3-flash"].input_tokens, 7)
+
+    def test_single_daemon_and_fallback(self) -> None:
+        """Verifies that a second daemon is refused and clients fall back."""
+        other = usage_daemon.UsageDaemon(base_dir=self.tmp_path)
+        with self.assertRaises(RuntimeError):
+            other.start()
+        other.close()
+        self.assertTrue(usage_daemon.socket_path(self.tmp_path).exists())
+
+        self.stop.set()
+        self.thread.join()
+        self.daemon.close()
+        self.assertIsNone(usage_daemon.fetch_stats(base_dir=self.tmp_path))
+        # A socket left behind by a killed daemon is not answered either
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(str(usage_daemon.socket_path(self.tmp_path)))
+        self.assertIsNone(usage_daemon.fetch_stats(base_dir=self.tmp_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
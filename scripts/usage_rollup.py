@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Compact, mergeable rollups of aggregated Gemini token usage.
+
+A rollup holds per date and model token and cost totals, plus the
+64-bit hashes of the sessions behind each row, and nothing from the
+session files themselves. Rollups from many machines merge into one
+UsageTable, and distinct sessions stay exact as long as no two session
+ids share a hash.
+
+The file is JSON lines: a header line, then one line per (date, model)
+row, so that merge_rollups streams through any number of files while
+only holding the merged totals in memory.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import socket
+import sys
+import time
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import token_usage
+
+ROLLUP_FORMAT = "gemini-usage-rollup"
+ROLLUP_VERSION = 1
+# Session names of merged tables are their hash, in hex after this prefix
+HASH_PREFIX = "#"
+
+
+class RollupError(ValueError):
+    """Raised for a file that is not a readable rollup of this version."""
+
+
+def session_hash(session_id: str) -> int:
+    """Returns the 64-bit hash that stands for a session in rollups."""
+    if session_id.startswith(HASH_PREFIX):
+        return int(session_id[len(HASH_PREFIX):], 16)
+    return int.from_bytes(hashlib.blake2b(session_id.encode("utf-8"),
+                                          digest_size=8).digest(), "little")
+
+
+def default_source(roots: Optional[Sequence[Path]] = None,
+                   start_date: Optional[str] = None,
+                   end_date: Optional[str] = None) -> str:
+    """Names the data of an export: host, resolved roots and date range.
+
+    Merges keep one rollup per source, so exports of different roots or
+    ranges on one host must not share a source name.
+
+    Args:
+        roots: Roots aggregated, as for token_usage.aggregate_usage;
+               defaults to ~/.gemini/tmp.
+        start_date: Optional first date (YYYY-MM-DD) exported.
+        end_date: Optional last date (YYYY-MM-DD) exported.
+    """
+    if not roots:
+        roots = [token_usage._usage_dirs(None)[0]]
+    source = f"{socket.gethostname()}:" + ",".join(
+        str(Path(root).resolve()) for root in roots)
+    if start_date or end_date:
+        source += f"@{start_date or ''}..{end_date or ''}"
+    return source
+
+
+def _pack_hashes(hashes: List[int]) -> str:
+    """Encodes sorted session hashes as base64 little-endian uint64s."""
+    packed = array("Q", sorted(hashes))
+    if packed.itemsize != 8:
+        raise RollupError("64-bit unsigned arrays are not available")
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+def _unpack_hashes(data: str) -> array:
+    """Decodes the session hashes of a rollup row."""
+    hashes = array("Q")
+    hashes.frombytes(base64.b64decode(data))
+    return hashes
+
+
+def export_rollup(stats: token_usage.UsageTable, path: Path,
+                  source: Optional[str] = None) -> int:
+    """Atomically writes a rollup of stats.
+
+    Args:
+        stats: Aggregated usage, e.g. from token_usage.aggregate_usage.
+        path: The rollup file to write.
+        source: Name of the data the usage comes from; merges keep only
+                the newest rollup of each source. Defaults to
+                default_source(), the host and ~/.gemini/tmp.
+
+    Returns:
+        The number of rows written.
+    """
+    header = {"format": ROLLUP_FORMAT, "version": ROLLUP_VERSION,
+              "source": source or default_source(),
+              "created": time.time()}
+    names = stats.session_names
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    rows = 0
+    try:
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            for date_id, models in stats.days.items():
+                for model_id, row in models.items():
+                    f.write(json.dumps({
+                        "d": stats.dates[date_id],
+                        "m": stats.models[model_id],
+                        "i": stats.input_col[row],
+                        "c": stats.cached_col[row],
+                        "o": stats.output_col[row],
+                        "$": stats.cost_col[row],
+                        "s": _pack_hashes([session_hash(names[sid]) for sid
+                                           in stats.session_col[row]]),
+                    }) + "\n")
+                    rows += 1
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return rows
+
+
+def read_header(path: Path) -> Dict[str, Any]:
+    """Reads and checks the header line of a rollup.
+
+    Raises:
+        RollupError: If the file is not a rollup of a supported version.
+    """
+    try:
+        with Path(path).open("r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError) as e:
+        raise RollupError(f"{path}: unreadable rollup ({e})") from e
+    if not isinstance(header, dict) or header.get("format") != ROLLUP_FORMAT:
+        raise RollupError(f"{path}: not a usage rollup")
+    if header.get("version") != ROLLUP_VERSION:
+        raise RollupError(f"{path}: unsupported rollup version "
+                          f"{header.get('version')}")
+    return header
+
+
+def _read_rows(path: Path) -> Iterator[Tuple[str, str, int, int, int, float,
+                                             array]]:
+    """Streams the rows of a rollup, one line at a time."""
+    with Path(path).open("r", encoding="utf-8") as f:
+        f.readline()
+        for line_no, line in enumerate(f, 2):
+            try:
+                row = json.loads(line)
+                yield (row["d"], row["m"], row["i"], row["c"], row["o"],
+                       row["$"], _unpack_hashes(row["s"]))
+            except (ValueError, KeyError, TypeError) as e:
+                raise RollupError(f"{path}:{line_no}: bad row ({e})") from e
+
+
+def latest_per_source(paths: Sequence[Path]) -> List[Path]:
+    """Drops all but the newest rollup of each source, keeping path order.
+
+    Exports are snapshots of everything a source has used so far, so two
+    rollups of one source would count its usage twice. Each dropped
+    rollup is reported on stderr.
+
+    Raises:
+        RollupError: If a file is not a supported rollup.
+    """
+    newest: Dict[str, Tuple[float, Path]] = {}
+    for path in paths:
+        header = read_header(path)
+        source = header.get("source", str(path))
+        if source not in newest or header["created"] >= newest[source][0]:
+            newest[source] = (header["created"], path)
+    kept = {path for _, path in newest.values()}
+    for path in paths:
+        if path not in kept:
+            source = read_header(path).get("source", str(path))
+            print(f"Warning: skipping {path}: {newest[source][1]} is a newer "
+                  f"rollup of source {source!r}", file=sys.stderr)
+    # A file given twice is still only one snapshot
+    return list(dict.fromkeys(path for path in paths if path in kept))
+
+
+def merge_rollups(paths: Sequence[Path],
+                  start_date: Optional[str] = None,
+                  end_date: Optional[str] = None) -> token_usage.UsageTable:
+    """Merges rollups into one UsageTable, reading one row at a time.
+
+    Only the newest rollup of each source is used. Session names of the
+    result are HASH_PREFIX plus the hex session hash, so the table can be
+    exported again as a rollup of rollups.
+
+    Args:
+        paths: Rollup files written by export_rollup.
+        start_date: Optional first date (YYYY-MM-DD) to keep.
+        end_date: Optional last date (YYYY-MM-DD) to keep.
+
+    Raises:
+        RollupError: If a file is not a supported rollup or is damaged.
+    """
+    stats = token_usage.UsageTable()
+    for path in latest_per_source(paths):
+        for (date_str, model, inp, cached, out, cost,
+             hashes) in _read_rows(path):
+            if not token_usage._in_range(date_str, start_date, end_date):
+                continue
+            stats.add(date_str, model, None, inp, cached, out, cost)
+            for h in hashes:
+                stats.add(date_str, model, f"{HASH_PREFIX}{h:016x}",
+                          0, 0, 0, 0.0)
+    return stats
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Tests for exporting and merging usage rollups."""
+
+import io
+import json
+import os
+import sys
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+# Add the scripts directory to path to import the modules
+sys.path.append(os.path.dirname(__file__))
+import token_usage
+import usage_rollup
+from testutil import summarize
+
+
+def _table(rows: list) -> token_usage.UsageTable:
+    """Builds a UsageTable from (date, model, session, input, cost) rows."""
+    stats = token_usage.UsageTable()
+    for date_str, model, session_id, inp, cost in rows:
+        stats.add(date_str, model, session_id, inp, inp // 2, 1, cost)
+    return stats
+
+
+class TestUsageRollup(unittest.TestCase):
+    """Round trips, source deduplication and error handling of rollups."""
+
+    def setUp(self) -> None:
+        self.tmpdir = TemporaryDirectory()
+        self.tmp_path = Path(self.tmpdir.name)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self) -> None:
+        """Verifies that a merged rollup reproduces the exported stats."""
+        stats = _table([
+            ("2026-01-20", "gemini-3-flash", "s1", 100, 0.25),
+            ("2026-01-20", "gemini-3-flash", "s2", 50, 0.125),
+            ("2026-01-20", "gemini-2.5-pro", "s1", 7, 0.5),
+            ("2026-01-21", "gemini-3-flash", "s3", 9, 0.0625),
+        ])
+        path = self.tmp_path / "a.rollup"
+        self.assertEqual(usage_rollup.export_rollup(stats, path, "a"), 3)
+        merged = usage_rollup.merge_rollups([path])
+        # Merged sessions are hashes: compare their counts
+        expected = summarize(stats, session_names=False)
+        self.assertEqual(summarize(merged, session_names=False), expected)
+        self.assertEqual(token_usage.day_totals(merged["2026-01-20"])[0], 2)
+
+        # Session ids only leave the machine as hashes, and rollups of
+        # rollups keep the same session hashes
+        self.assertNotIn("s1", path.read_text().split("\n", 1)[1])
+        again = self.tmp_path / "b.rollup"
+        usage_rollup.export_rollup(merged, again, "b")
+        self.assertEqual(summarize(usage_rollup.merge_rollups([again]),
+                                   session_names=False), expected)
+
+        only = usage_rollup.merge_rollups([path], "2026-01-21", "2026-01-21")
+        self.assertEqual(sorted(only), ["2026-01-21"])
+
+    def test_merge_sources(self) -> None:
+        """Verifies distinct sessions across sources and newest-per-source."""
+        paths = [self.tmp_path / f"{i}.rollup" for i in range(3)]
+        usage_rollup.export_rollup(_table([
+            ("2026-01-20", "gemini-3-flash", "s1", 100, 1.0)]), paths[0], "a")
+        usage_rollup.export_rollup(_table([
+            ("2026-01-20", "gemini-3-flash", "s1", 10, 0.5),
+            ("2026-01-20", "gemini-3-flash", "s2", 10, 0.5)]), paths[1], "b")
+        # A newer snapshot of source a replaces the first one
+        usage_rollup.export_rollup(_table([
+            ("2026-01-20", "gemini-3-flash", "s1", 300, 3.0)]), paths[2], "a")
+
+        with patch("sys.stderr", io.StringIO()) as err:
+            self.assertEqual(usage_rollup.latest_per_source(paths), paths[1:])
+        self.assertIn(f"skipping {paths[0]}", err.getvalue())
+        with patch("sys.stderr", io.StringIO()):
+            merged = usage_rollup.merge_rollups(paths)
+        row = merged["2026-01-20"]["gemini-3-flash"]
+        self.assertEqual((row.session_count, row.input_tokens, row.cost),
+                         (2, 320, 4.0))
+
+    def test_same_host_exports(self) -> None:
+        """Verifies that exports of other roots or ranges are all merged."""
+        sources = [usage_rollup.default_source([self.tmp_path / "treeA"]),
+                   usage_rollup.default_source([self.tmp_path / "treeB"]),
+                   usage_rollup.default_source([self.tmp_path / "treeA"],
+                                               "2026-01-21", "2026-01-21")]
+        self.assertEqual(len(set(sources)), 3)
+        self.assertIn(str((self.tmp_path / "treeA").resolve()), sources[0])
+
+        paths = [self.tmp_path / f"{i}.rollup" for i in range(3)]
+        for i, (path, source) in enumerate(zip(paths, sources)):
+            usage_rollup.export_rollup(_table([
+                ("2026-01-21", "gemini-3-flash", f"s{i}", 10, 1.0)]),
+                path, source)
+        with patch("sys.stderr", io.StringIO()) as err:
+            merged = usage_rollup.merge_rollups(paths)
+        self.assertEqual(err.getvalue(), "")
+        self.assertEqual(merged["2026-01-21"]["gemini-3-flash"].input_tokens, 30)
+
+    def test_bad_rollups(self) -> None:
+        """Verifies that foreign, newer and damaged files are reported."""
+        path = self.tmp_path / "x.rollup"
+        path.write_text("{}\n")
+        with self.assertRaisesRegex(usage_rollup.RollupError, "not a usage"):
+            usage_rollup.merge_rollups([path])
+
+        path.write_text(json.dumps({"format": usage_rollup.ROLLUP_FORMAT,
+                                    "version": 99}) + "\n")
+        with self.assertRaisesRegex(usage_rollup.RollupError, "version 99"):
+            usage_rollup.merge_rollups([path])
+
+        usage_rollup.export_rollup(_table([
+            ("2026-01-20", "gemini-3-flash", "s1", 1, 0.1)]), path, "a")
+        with path.open("a") as f:
+            f.write('{"d": "2026-01-21"}\n')
+        with self.assertRaisesRegex(usage_rollup.RollupError, ":3: bad row"):
+            usage_rollup.merge_rollups([path])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""Prints today/week/month usage totals for status bars and prompts.
+
+The totals, and the cost of each day of this month, come from a small
+binary snapshot that token_usage.py writes on every aggregation covering
+this week and month. The same snapshot answers --budget, a month-end cost
+projection cheap enough to run before every Gemini CLI start. Only a missing or
+stale snapshot makes this module import token_usage and rescan that range.
+To keep the usual path well under 10ms, only builtin modules are imported,
+and annotations are not evaluated (the typing module alone costs more).
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+import sys
+import time
+
+SNAPSHOT_FILE = "usage_snapshot.bin"
+# Seconds after which a snapshot is rescanned even on the same day
+DEFAULT_MAX_AGE = 60.0
+PERIODS = ("today", "week", "month")
+
+# Days of the trailing rate of budget projections
+TRAILING_DAYS = 7
+
+_MAGIC = b"GUS2"
+_HEADER = struct.Struct("<4sd10s10s10s")
+# Totals of one period: sessions, input, cached, output, cost
+_TOTALS = struct.Struct("<qqqqd")
+# Number of daily costs that follow, one per day of the month until today
+_DAYS = struct.Struct("<B")
+
+
+def period_starts(now: float | None = None) -> tuple[str, str, str]:
+    """Returns today, the Monday of this week and the 1st of this month."""
+    t = time.localtime(now)
+    # Noon avoids DST transitions moving the result across midnight
+    monday = time.localtime(time.mktime(
+        (t.tm_year, t.tm_mon, t.tm_mday - t.tm_wday, 12, 0, 0, 0, 0, -1)))
+    return (time.strftime("%Y-%m-%d", t),
+            time.strftime("%Y-%m-%d", monday),
+            time.strftime("%Y-%m-%d", t)[:8] + "01")
+
+
+def month_days(starts: tuple[str, str, str]) -> list[str]:
+    """Returns the dates from the 1st of this month to today."""
+    return [f"{starts[2][:8]}{day:02d}"
+            for day in range(1, int(starts[0][8:]) + 1)]
+
+
+def days_in_month(today: str) -> int:
+    """Returns the number of days in the month of a YYYY-MM-DD date."""
+    # Day 0 of the next month is the last day of this one
+    return time.localtime(time.mktime(
+        (int(today[:4]), int(today[5:7]) + 1, 0, 12, 0, 0, 0, 0, -1))).tm_mday
+
+
+def snapshot_path(base_dir: str | None = None) -> str:
+    """Returns where the snapshot lives, next to the usage cache."""
+    if base_dir:
+        return os.path.join(base_dir, SNAPSHOT_FILE)
+    return os.path.join(os.path.expanduser("~"), ".gemini", SNAPSHOT_FILE)
+
+
+def write_snapshot(path: str, starts: tuple[str, str, str],
+                   totals: list[tuple], daily_costs: list[float] = ()) -> None:
+    """Atomically writes the totals of the periods starting at starts.
+
+    Args:
+        path: The snapshot file.
+        starts: Period starts, as returned by period_starts().
+        totals: Totals for today, this week and this month.
+        daily_costs: Cost of each day in month_days(starts).
+    """
+    data = _HEADER.pack(_MAGIC, time.time(),
+                        *(s.encode("ascii") for s in starts))
+    data += b"".join(_TOTALS.pack(*t) for t in totals)
+    data += _DAYS.pack(len(daily_costs))
+    data += struct.pack(f"<{len(daily_costs)}d", *daily_costs)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def read_snapshot(path: str) -> tuple[float, tuple[str, str, str],
+                                      list[tuple], list[float]] | None:
+    """Returns (written_at, period starts, totals, daily costs).
+
+    Returns None if the snapshot is missing, damaged or of another version.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    days_at = _HEADER.size + 3 * _TOTALS.size
+    if len(data) < days_at + _DAYS.size or data[:4] != _MAGIC:
+        return None
+    (days,) = _DAYS.unpack_from(data, days_at)
+    if len(data) != days_at + _DAYS.size + 8 * days:
+        return None
+    _, written_at, *starts = _HEADER.unpack_from(data)
+    totals = [_TOTALS.unpack_from(data, _HEADER.size + i * _TOTALS.size)
+              for i in range(3)]
+    daily_costs = list(struct.unpack_from(f"<{days}d", data,
+                                          days_at + _DAYS.size))
+    return (written_at, tuple(s.decode("ascii") for s in starts), totals,
+            daily_costs)
+
+
+def load_snapshot(base_dir: str | None = None,
+                  max_age: float = DEFAULT_MAX_AGE
+                  ) -> tuple[list[tuple], list[float]]:
+    """Returns the period totals and daily costs of this month.
+
+    They are read from the snapshot unless it is stale: written for
+    another day, or more than max_age seconds ago. The rescan only covers
+    this week and month, and writes a fresh snapshot.
+    """
+    path = snapshot_path(base_dir)
+    now = time.time()
+    starts = period_starts(now)
+    snapshot = read_snapshot(path)
+    if (snapshot is not None and snapshot[1] == starts
+            and 0 <= now - snapshot[0] <= max_age):
+        return snapshot[2], snapshot[3]
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import token_usage  # pylint: disable=import-outside-toplevel
+    stats = token_usage.aggregate_usage(base_dir=base_dir,
+                                        jobs=None,
+                                        start_date=min(starts[1:]),
+                                        end_date=starts[0])
+    return ([stats.range_totals(start, starts[0]) for start in starts],
+            [stats.range_totals(day, day)[4] for day in month_days(starts)])
+
+
+def load_totals(base_dir: str | None = None,
+                max_age: float = DEFAULT_MAX_AGE) -> list[tuple]:
+    """Returns today/week/month totals, rescanning if the snapshot is stale."""
+    return load_snapshot(base_dir, max_age)[0]
+
+
+def project_month(daily_costs: list[float],
+                  today: str) -> tuple[float, float, float]:
+    """Projects the month-end cost from the costs of the days so far.
+
+    Args:
+        daily_costs: Cost of each day from the 1st of the month to today.
+        today: Today's date, YYYY-MM-DD.
+
+    Returns:
+        (month to date, linear projection, trailing projection). The
+        linear projection extends the average day of the month so far; the
+        trailing one adds the remaining days at the average of the last
+        TRAILING_DAYS days, or of the days so far early in the month.
+    """
+    elapsed = len(daily_costs)
+    month_to_date = sum(daily_costs)
+    if not elapsed:
+        return 0.0, 0.0, 0.0
+    remaining = days_in_month(today) - elapsed
+    trailing = daily_costs[-TRAILING_DAYS:]
+    return (month_to_date,
+            month_to_date / elapsed * (elapsed + remaining),
+            month_to_date + sum(trailing) / len(trailing) * remaining)
+
+
+def format_budget(projection: tuple[float, float, float],
+                  limit: float) -> tuple[str, bool]:
+    """Formats a month projection against a budget.
+
+    Returns:
+        The status line, and whether either projection is over budget.
+    """
+    month_to_date, linear, trailing = projection
+    over = max(linear, trailing) > limit
+    return (f"month ${month_to_date:,.2f} | projected ${linear:,.2f} linear, "
+            f"${trailing:,.2f} trailing {TRAILING_DAYS}d | budget "
+            f"${limit:,.2f}{' EXCEEDED' if over else ''}"), over
+
+
+def format_totals(totals: list[tuple], raw: bool = False,
+                  period: str | None = None) -> str:
+    """Formats totals as one status line.
+
+    Args:
+        totals: Totals for today, this week and this month.
+        raw: Print only the total token count, like --today --raw.
+        period: Limit the output to one of PERIODS.
+    """
+    selected = [(name, t) for name, t in zip(PERIODS, totals)
+                if period is None or name == period]
+    if raw:
+        return str(sum(t[1] + t[2] + t[3] for _, t in selected[:1]))
+    return " | ".join(f"{name} {t[1] + t[2] + t[3]:,} tok ${t[4]:,.2f}"
+                      for name, t in selected)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """CLI entry point: [--raw] [--period P] [--budget USD] [--max-age S].
+
+    With --budget, prints the month-end projection instead of the totals
+    and returns 1 when it is over budget, so that shell hooks can refuse
+    to start or warn.
+    """
+    args = sys.argv[1:] if argv is None else argv
+    raw = False
+    period = None
+    budget = None
+    max_age = DEFAULT_MAX_AGE
+    usage = ("usage: usage_status.py [--raw] [--period today|week|month] "
+             "[--budget USD] [--max-age SECONDS]")
+    # argparse alone would take several milliseconds to import
+    i = 0
+    try:
+        while i < len(args):
+            if args[i] == "--raw":
+                raw = True
+            elif args[i] == "--period" and args[i + 1] in PERIODS:
+                period = args[i + 1]
+                i += 1
+            elif args[i] == "--budget":
+                budget = float(args[i + 1])
+                i += 1
+            elif args[i] == "--max-age":
+                max_age = float(args[i + 1])
+                i += 1
+            else:
+                raise ValueError(args[i])
+            i += 1
+    except (IndexError, ValueError):
+        print(usage, file=sys.stderr)
+        return 2
+    totals, daily_costs = load_snapshot(max_age=max_age)
+    if budget is not None:
+        line, over = format_budget(
+            project_month(daily_costs, period_starts()[0]), budget)
+        print(line)
+        return 1 if over else 0
+    print(format_totals(totals, raw, period))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
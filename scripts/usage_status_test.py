@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Tests for the usage_status snapshot entry point."""
+
+import io
+import os
+import subprocess
+import sys
+import time
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+# Add the scripts directory to path to import the modules
+sys.path.append(os.path.dirname(__file__))
+import token_usage
+import usage_status
+from testutil import gemini_message, write_session
+
+# The status line must stay below this, excluding interpreter startup
+LATENCY_TARGET_US = 10_000
+
+
+class TestUsageStatus(unittest.TestCase):
+    """Snapshot writing, staleness and latency of the status entry point."""
+
+    def setUp(self) -> None:
+        self.tmpdir = TemporaryDirectory()
+        self.tmp_path = Path(self.tmpdir.name)
+        today = usage_status.period_starts()[0]
+        for i, day in enumerate([today, "2020-01-01"]):
+            write_session(
+                self.tmp_path / "project1" / "chats" / f"session-{i}.json",
+                f"s{i}", [gemini_message(input=100, cached=10, output=1)], day)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def test_snapshot_written_by_aggregation(self) -> None:
+        """Verifies that only aggregations covering the month write a snapshot."""
+        path = usage_status.snapshot_path(self.tmp_path)
+        today = usage_status.period_starts()[0]
+        token_usage.aggregate_usage(base_dir=self.tmp_path, start_date=today)
+        self.assertFalse(os.path.exists(path))
+
+        token_usage.aggregate_usage(base_dir=self.tmp_path)
+        written_at, starts, totals, daily_costs = usage_status.read_snapshot(path)
+        self.assertEqual(starts, usage_status.period_starts())
+        self.assertAlmostEqual(written_at, time.time(), delta=60)
+        for sessions, inp, cached, out, cost in totals:
+            self.assertEqual((sessions, inp, cached, out), (1, 100, 10, 1))
+            self.assertGreater(cost, 0)
+        self.assertEqual(len(daily_costs), int(today[8:]))
+        self.assertEqual(daily_costs[-1], totals[0][4])
+        self.assertAlmostEqual(sum(daily_costs), totals[2][4])
+
+        # A fresh snapshot is answered without rescanning
+        with patch.object(token_usage, "aggregate_usage",
+                          side_effect=AssertionError("rescanned")):
+            self.assertEqual(usage_status.load_totals(self.tmp_path), totals)
+        self.assertEqual(usage_status.format_totals(totals, raw=True), "111")
+        self.assertEqual(usage_status.format_totals(totals, period="week"),
+                         f"week 111 tok ${totals[1][4]:,.2f}")
+
+    def test_stale_snapshot_rescans(self) -> None:
+        """Verifies the scoped rescan of an old or missing snapshot."""
+        path = usage_status.snapshot_path(self.tmp_path)
+        usage_status.write_snapshot(path, ("2020-01-01",) * 3,
+                                    [(9, 9, 9, 9, 9.0)] * 3)
+        totals = usage_status.load_totals(self.tmp_path)
+        self.assertEqual([t[1] for t in totals], [100, 100, 100])
+        self.assertEqual(usage_status.read_snapshot(path)[1],
+                         usage_status.period_starts())
+
+        with patch.object(token_usage, "aggregate_usage",
+                          wraps=token_usage.aggregate_usage) as aggregate:
+            usage_status.load_totals(self.tmp_path, max_age=-1)
+        starts = usage_status.period_starts()
+        self.assertEqual(aggregate.call_args.kwargs["start_date"], min(starts[1:]))
+
+    def test_budget_projection(self) -> None:
+        """Verifies month-end projections and the budget exit status."""
+        self.assertEqual(usage_status.days_in_month("2026-02-10"), 28)
+        self.assertEqual(usage_status.days_in_month("2024-02-29"), 29)
+        self.assertEqual(usage_status.days_in_month("2026-12-31"), 31)
+
+        # 10 days at $1, then 2 days at $4.5: $19 after 12 of 30 days
+        costs = [1.0] * 10 + [4.5] * 2
+        month, linear, trailing = usage_status.project_month(costs, "2026-04-12")
+        self.assertEqual(month, 19.0)
+        self.assertAlmostEqual(linear, 19.0 / 12 * 30)
+        self.assertAlmostEqual(trailing, 19.0 + 2.0 * 18)
+        # Early in the month the trailing rate uses the days so far
+        self.assertEqual(usage_status.project_month([3.0], "2026-04-01"),
+                         (3.0, 90.0, 90.0))
+        self.assertEqual(usage_status.project_month([], "2026-04-01"),
+                         (0.0, 0.0, 0.0))
+        self.assertEqual(usage_status.format_budget((1.0, 2.0, 3.0), 2.5)[1],
+                         True)
+
+        token_usage.aggregate_usage(base_dir=self.tmp_path)
+        _, daily_costs = usage_status.load_snapshot(self.tmp_path)
+        _, linear, trailing = usage_status.project_month(
+            daily_costs, usage_status.period_starts()[0])
+        with patch.object(usage_status, "snapshot_path",
+                          return_value=usage_status.snapshot_path(self.tmp_path)), \
+                patch.object(token_usage, "aggregate_usage",
+                             side_effect=AssertionError("rescanned")), \
+                patch("sys.stdout", io.StringIO()) as out:
+            self.assertEqual(usage_status.main(
+                ["--budget", str(max(linear, trailing) + 1)]), 0)
+            self.assertEqual(usage_status.main(
+                ["--budget", str(min(linear, trailing) / 2)]), 1)
+        self.assertIn("EXCEEDED", out.getvalue().splitlines()[1])
+
+        scripts_dir = os.path.dirname(os.path.abspath(__file__))
+        result = subprocess.run(
+            [sys.executable, "token_usage.py", "--root", str(self.tmp_path),
+             "budget", "0"], cwd=scripts_dir, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 1, result.stderr)
+        self.assertIn("EXCEEDED", result.stdout)
+
+    def test_idle_watcher_keeps_snapshot_fresh(self) -> None:
+        """Verifies that a watcher without changes still rewrites the snapshot."""
+        path = usage_status.snapshot_path(self.tmp_path)
+        watcher = token_usage.UsageWatcher(base_dir=self.tmp_path)
+        try:
+            with patch.object(token_usage, "SNAPSHOT_REFRESH_SECONDS", 0.05):
+                watcher.start()
+                written_at = usage_status.read_snapshot(path)[0]
+                self.assertFalse(watcher.wait(timeout=0.3))
+            self.assertGreater(usage_status.read_snapshot(path)[0], written_at)
+        finally:
+            watcher.close()
+        with patch.object(token_usage, "aggregate_usage",
+                          side_effect=AssertionError("rescanned")):
+            usage_status.load_totals(self.tmp_path, max_age=0.5)
+
+    def test_main_usage_errors(self) -> None:
+        """Verifies that bad arguments print usage instead of scanning."""
+        with patch("sys.stderr", io.StringIO()) as err:
+            self.assertEqual(usage_status.main(["--period", "year"]), 2)
+        self.assertIn("usage:", err.getvalue())
+
+    def test_latency_benchmark(self) -> None:
+        """Benchmarks import time and a snapshot read against the target."""
+        token_usage.aggregate_usage(base_dir=self.tmp_path)
+        scripts_dir = os.path.dirname(os.path.abspath(__file__))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import usage_status"],
+            cwd=scripts_dir, capture_output=True, text=True, check=True)
+        import_us = None
+        for line in result.stderr.splitlines():
+            # "import time: self [us] | cumulative | name"
+            fields = [f.strip() for f in line.split("|")]
+            if len(fields) == 3 and fields[2] == "usage_status":
+                import_us = int(fields[1])
+        self.assertIsNotNone(import_us)
+        self.assertNotIn("token_usage", result.stderr)
+
+        runs = []
+        for _ in range(20):
+            start = time.perf_counter()
+            usage_status.format_totals(usage_status.load_totals(self.tmp_path))
+            runs.append((time.perf_counter() - start) * 1e6)
+        read_us = sorted(runs)[len(runs) // 2]
+        self.assertLess(import_us + read_us, LATENCY_TARGET_US,
+                        f"import {import_us}us + read {read_us:.0f}us")
+
+
+if __name__ == "__main__":
+    unittest.main()